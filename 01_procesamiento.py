@@ -1,43 +1,61 @@
 import pandas as pd
 import numpy as np
-import unicodedata
 import os
+from concurrent.futures import ThreadPoolExecutor
+from io_utils import normalizar_texto, PATH_SIMCE_4B, PATH_SIMCE_2M, COLS_S4, COLS_S2, DTYPES_S4, DTYPES_S2
 
 # --- CONFIGURACIÓN ---
 # Bounding Box Urbano [min_lon, min_lat, max_lon, max_lat]
 BBOX = [-70.872116, -33.642527, -70.469742, -33.327552]
 # Mínimo de colegios para considerar la comuna válida estadísticamente
 MIN_COLEGIOS_POR_COMUNA = 3
-
-def normalizar_texto(texto):
-    """Estandariza strings: Mayúsculas, sin tildes, sin espacios extra."""
-    if pd.isna(texto):
-        return "DESCONOCIDO"
-    texto = str(texto).upper()
-    texto = unicodedata.normalize('NFD', texto)
-    texto = u"".join([c for c in texto if unicodedata.category(c) != 'Mn'])
-    return texto.strip()
-
-def clean_coord(val):
+# Región Metropolitana (COD_REG_RBD) y tamaño de bloque para leer EE filtrando al vuelo
+REGION_RM = 13
+CHUNK_FILAS_EE = 50_000
+OUTPUT_PATH = 'data/processed/base_consolidada_rm_2024_final.csv'
+
+# Esquema de lectura: solo columnas usadas y enteros angostos.
+# RBD y ENS_* de EE no se fijan porque el archivo trae filas mal formadas (se limpian después);
+# por lo mismo EE se lee con el parser de C, que tolera esas filas.
+COLS_EE = ['RBD', 'NOM_RBD', 'COD_REG_RBD', 'COD_COM_RBD', 'NOM_COM_RBD', 'COD_DEPE',
+           'RURAL_RBD', 'LATITUD', 'LONGITUD', 'PAGO_MENSUAL'] + [f'ENS_{i:02d}' for i in range(1, 12)]
+DTYPES_EE = {'COD_REG_RBD': 'int8', 'COD_COM_RBD': 'int32', 'COD_DEPE': 'int8', 'RURAL_RBD': 'int8'}
+DTYPES_MAT = {'RBD': 'int32', 'MAT_TOTAL': 'int32', 'CUR_SIM_TOT': 'int32'}
+DTYPES_DOC = {'RBD': 'int32', 'DC_TOT': 'int32'}
+# Dependencia por COD_DEPE: la posición en la lista es el código (0 = cualquier otro código)
+DEP_LUT = ['OTRO', 'MUNICIPAL_CORP', 'MUNICIPAL_DAEM', 'PARTICULAR_SUBV',
+           'PARTICULAR_PAGADO', 'ADMIN_DELEGADA', 'SLEP']
+
+def leer_ee_rm(path):
+    """Lee EE por bloques y conserva solo la RM: el resto del país nunca se materializa completo."""
+    # Parser de C por bloques (tolera las filas mal formadas); el filtro de región se aplica a cada bloque
+    bloques = pd.read_csv(path, sep=';', encoding='utf-8', low_memory=False,
+                          usecols=lambda c: c in COLS_EE, dtype=DTYPES_EE, chunksize=CHUNK_FILAS_EE)
+    return pd.concat([b[b['COD_REG_RBD'] == REGION_RM] for b in bloques], ignore_index=True)
+
+def clean_coord(serie):
     """Limpia coordenadas que pueden venir con coma decimal."""
-    if isinstance(val, str):
-        val = val.replace(',', '.')
-    return pd.to_numeric(val, errors='coerce')
+    return pd.to_numeric(serie.astype(str).str.replace(',', '.', regex=False), errors='coerce')
+
+def promedio_simce(lect, mate):
+    """Promedio Lectura/Matemática; si falta una prueba se usa la otra."""
+    # float32 como los puntajes de origen (DTYPES_S4/S2): no se sube a float64 solo para promediar
+    a = lect.to_numpy(dtype=np.float32)
+    b = mate.to_numpy(dtype=np.float32)
+    return np.where(np.isnan(a), b, np.where(np.isnan(b), a, (a + b) * np.float32(0.5)))
 
-def clasificar_pago_consolidado(row):
+def clasificar_pago_consolidado(df):
     """Regla de Negocio: Gratuito vs Pagado (para visualización Rojo/Verde)"""
-    pago = str(row['PAGO_MENSUAL']).upper()
-    dep = str(row['categoria_dependencia']).upper()
-    
-    if pago == 'GRATUITO': 
-        return 'Gratuito'
+    pago = df['PAGO_MENSUAL'].astype(str).str.upper()
+    dep = df['categoria_dependencia'].astype(str).str.upper()
+
+    es_gratuito = pago.eq('GRATUITO')
     # Asumir gratuidad si es público y no hay info
-    if pago == 'SIN INFORMACION' and any(x in dep for x in ['MUNICIPAL', 'SLEP', 'ADMIN']): 
-        return 'Gratuito'
-    
-    return 'Pagado'
+    es_publico_sin_info = pago.eq('SIN INFORMACION') & dep.str.contains('MUNICIPAL|SLEP|ADMIN', regex=True, na=False)
+
+    return np.where(es_gratuito | es_publico_sin_info, 'Gratuito', 'Pagado')
 
-def main():
+def main(output_path=OUTPUT_PATH, integrar_simce=True, filtro_geografico=True):
     print(">>> INICIANDO PROCESAMIENTO CONSOLIDADO (Bloque 1 - Corregido) <<<")
     os.makedirs('data/processed', exist_ok=True)
 
@@ -45,41 +63,51 @@ def main():
     # 1. CARGA Y LIMPIEZA INICIAL
     # -------------------------------------------------------------------------
     print("1. Cargando archivos RAW...")
-    try:
-        df_ee = pd.read_csv('data/raw/EE_2024.csv', sep=';', encoding='utf-8', low_memory=False)
-        df_mat = pd.read_csv('data/raw/Matricula_2024.csv', sep=';', encoding='utf-8', low_memory=False)
-        df_doc = pd.read_csv('data/raw/Docente_2024.csv', sep=';', encoding='utf-8', low_memory=False)
-    except FileNotFoundError as e:
-        print(f"❌ Error: Falta archivo raw -> {e}")
-        return
+    # Las lecturas son independientes: se lanzan en paralelo (incluido SIMCE, que se usa en el paso 4)
+    with ThreadPoolExecutor(max_workers=5) as ex:
+        fut_ee = ex.submit(leer_ee_rm, 'data/raw/EE_2024.csv') # ya filtrado a la RM (Región 13)
+        # Matrícula y Docentes vienen limpios: parser multihilo de pyarrow
+        fut_mat = ex.submit(pd.read_csv, 'data/raw/Matricula_2024.csv', sep=';', encoding='utf-8', engine='pyarrow',
+                            usecols=list(DTYPES_MAT), dtype=DTYPES_MAT)
+        fut_doc = ex.submit(pd.read_csv, 'data/raw/Docente_2024.csv', sep=';', encoding='utf-8', engine='pyarrow',
+                            usecols=list(DTYPES_DOC), dtype=DTYPES_DOC)
+        if integrar_simce:
+            fut_s4 = ex.submit(pd.read_csv, PATH_SIMCE_4B, sep=';', encoding='latin-1',
+                               usecols=list(COLS_S4), dtype=DTYPES_S4)
+            fut_s2 = ex.submit(pd.read_csv, PATH_SIMCE_2M, sep=';', encoding='latin-1',
+                               usecols=list(COLS_S2), dtype=DTYPES_S2)
+        try:
+            df_ee, df_mat, df_doc = fut_ee.result(), fut_mat.result(), fut_doc.result()
+        except FileNotFoundError as e:
+            print(f"❌ Error: Falta archivo raw -> {e}")
+            return
 
     # Normalizar RBD
     for df in [df_ee, df_mat, df_doc]:
         df['RBD'] = pd.to_numeric(df['RBD'], errors='coerce')
         df.dropna(subset=['RBD'], inplace=True)
-        df['RBD'] = df['RBD'].astype(int)
+        df['RBD'] = df['RBD'].astype('int32')
 
     # Filtro: Eliminar solo párvulos
     print("   -> Filtrando jardines infantiles puros...")
     cols_ens = [f'ENS_{i:02d}' for i in range(1, 12)]
-    ens_data = df_ee[cols_ens].replace(0, np.nan)
-    
-    def es_solo_parvulo(row):
-        niveles = set(row.dropna().unique())
-        return len(niveles) == 1 and 10 in niveles # 10 es Parvularia
-
-    mask_parvulos = ens_data.apply(es_solo_parvulo, axis=1)
-    df_ee = df_ee[~mask_parvulos].copy()
-
-    # Filtro: Solo RM (Región 13)
-    df_ee_rm = df_ee[df_ee['COD_REG_RBD'] == 13].copy()
+    # OJO (bug conocido, se conserva para no cambiar los resultados versionados): ENS_* llegan como texto
+    # (filas mal formadas), así que la comparación con 10 nunca calza y este filtro no elimina nada. Convertirlas
+    # a número quitaría ~90 establecimientos de la RM y obliga a regenerar bases, reportes y figuras
+    ens = df_ee[cols_ens].fillna(0).to_numpy()
+
+    # Solo párvulo: todos los niveles distintos de 0 son código 10 (Parvularia)
+    n_parvulo = (ens == 10).sum(axis=1)
+    mask_parvulos = (n_parvulo > 0) & (n_parvulo == (ens != 0).sum(axis=1))
+    # (EE ya viene solo con la RM desde leer_ee_rm: este es el único filtro y la única copia)
+    df_ee_rm = df_ee[~mask_parvulos].copy()
     
     # Normalizar Comunas
-    df_ee_rm['NOM_COM_RBD'] = df_ee_rm['NOM_COM_RBD'].apply(normalizar_texto)
+    df_ee_rm['NOM_COM_RBD'] = normalizar_texto(df_ee_rm['NOM_COM_RBD'], relleno='DESCONOCIDO')
 
     # Limpieza de Coordenadas
-    df_ee_rm['LATITUD'] = df_ee_rm['LATITUD'].apply(clean_coord)
-    df_ee_rm['LONGITUD'] = df_ee_rm['LONGITUD'].apply(clean_coord)
+    df_ee_rm['LATITUD'] = clean_coord(df_ee_rm['LATITUD'])
+    df_ee_rm['LONGITUD'] = clean_coord(df_ee_rm['LONGITUD'])
 
     # Selección de columnas base
     cols_ee = ['RBD', 'NOM_RBD', 'COD_COM_RBD', 'NOM_COM_RBD', 'COD_DEPE', 
@@ -91,18 +119,16 @@ def main():
     # -------------------------------------------------------------------------
     print("2. Calculando métricas de capacidad...")
     
-    # Matrícula y Cursos
-    df_mat_g = df_mat.groupby('RBD')['MAT_TOTAL'].sum().reset_index()
-    if 'CUR_SIM_TOT' in df_mat.columns:
-        df_cursos = df_mat.groupby('RBD')['CUR_SIM_TOT'].sum().reset_index()
-        df_mat_g = df_mat_g.merge(df_cursos, on='RBD', how='left')
-    
+    # Matrícula y Cursos (una sola agregación por RBD). sort=False: el join por índice no necesita
+    # las llaves ordenadas, así que no se paga el ordenamiento de los RBD agrupados
+    cols_mat = [c for c in ['MAT_TOTAL', 'CUR_SIM_TOT'] if c in df_mat.columns]
+    df_mat_g = df_mat.groupby('RBD', sort=False)[cols_mat].sum()
+
     # Docentes
-    df_doc_g = df_doc.groupby('RBD')['DC_TOT'].sum().reset_index()
+    df_doc_g = df_doc.groupby('RBD', sort=False)[['DC_TOT']].sum()
     
-    # Merge
-    df_master = df_ee_rm.merge(df_mat_g, on='RBD', how='left')
-    df_master = df_master.merge(df_doc_g, on='RBD', how='left')
+    # Merge: RBD como índice hasta terminar la integración SIMCE
+    df_master = df_ee_rm.set_index('RBD').join(df_mat_g, how='left').join(df_doc_g, how='left')
     
     # Limpieza nulos críticos
     df_master = df_master.dropna(subset=['LATITUD', 'LONGITUD', 'DC_TOT', 'MAT_TOTAL'])
@@ -111,88 +137,90 @@ def main():
     # Cálculo de Ratios
     df_master['ratio_alumno_docente'] = df_master['MAT_TOTAL'] / df_master['DC_TOT']
     if 'CUR_SIM_TOT' in df_master.columns:
-        df_master['ratio_alumno_curso'] = df_master.apply(
-            lambda x: x['MAT_TOTAL'] / x['CUR_SIM_TOT'] if x['CUR_SIM_TOT'] > 0 else np.nan, axis=1
-        )
+        cur = df_master['CUR_SIM_TOT'].to_numpy(dtype=np.float64)
+        mat = df_master['MAT_TOTAL'].to_numpy(dtype=np.float64)
+        ratio_curso = np.full_like(cur, np.nan)
+        np.divide(mat, cur, out=ratio_curso, where=cur > 0)
+        df_master['ratio_alumno_curso'] = ratio_curso
 
     # -------------------------------------------------------------------------
     # 3. CLASIFICACIONES DE NEGOCIO
     # -------------------------------------------------------------------------
     print("3. Aplicando reglas de negocio...")
-    dep_map = {1:'MUNICIPAL_CORP', 2:'MUNICIPAL_DAEM', 3:'PARTICULAR_SUBV', 
-               4:'PARTICULAR_PAGADO', 5:'ADMIN_DELEGADA', 6:'SLEP'}
-    df_master['categoria_dependencia'] = df_master['COD_DEPE'].map(dep_map).fillna('OTRO')
-    df_master['TIPO_PAGO'] = df_master.apply(clasificar_pago_consolidado, axis=1)
+    # COD_DEPE (int8) indexa directo la tabla DEP_LUT; cualquier código fuera de 1..6 cae en 0 = 'OTRO'
+    cod_depe = df_master['COD_DEPE'].to_numpy()
+    cod_depe = np.where((cod_depe >= 1) & (cod_depe < len(DEP_LUT)), cod_depe, 0).astype(np.int8)
+    df_master['categoria_dependencia'] = pd.Categorical.from_codes(cod_depe, categories=DEP_LUT).remove_unused_categories()
+    df_master['TIPO_PAGO'] = clasificar_pago_consolidado(df_master)
 
     precio_map = {'GRATUITO': 0, '$1.000 A $10.000': 1, '$10.001 A $25.000': 2,
                   '$25.001 A $50.000': 3, '$50.001 A $100.000': 4, 
                   'MAS DE $100.000': 5, 'SIN INFORMACION': -1}
-    df_master['PAGO_MENSUAL_NORM'] = df_master['PAGO_MENSUAL'].apply(lambda x: str(x).upper().strip())
-    df_master['orden_precio'] = df_master['PAGO_MENSUAL_NORM'].map(precio_map).fillna(-1)
+    df_master['PAGO_MENSUAL_NORM'] = df_master['PAGO_MENSUAL'].astype(str).str.upper().str.strip()
+    df_master['orden_precio'] = df_master['PAGO_MENSUAL_NORM'].map(precio_map).fillna(-1).astype(np.int8)
 
     # -------------------------------------------------------------------------
     # 4. INTEGRACIÓN SIMCE
     # -------------------------------------------------------------------------
-    print("4. Integrando SIMCE...")
-    try:
-        df_s4 = pd.read_csv('data/raw/simce4b2024_rbd_preliminar.csv', sep=';', encoding='latin-1')
-        df_s2 = pd.read_csv('data/raw/simce2m2024_rbd_preliminar.csv', sep=';', encoding='latin-1')
-        
-        cols_s4 = {'rbd':'RBD', 'prom_lect4b_rbd':'SIMCE_4B_LECT', 'prom_mate4b_rbd':'SIMCE_4B_MATE'}
-        cols_s2 = {'rbd':'RBD', 'prom_lect2m_rbd':'SIMCE_2M_LECT', 'prom_mate2m_rbd':'SIMCE_2M_MATE'}
-        
-        df_s4_sel = df_s4[cols_s4.keys()].rename(columns=cols_s4)
-        df_s2_sel = df_s2[cols_s2.keys()].rename(columns=cols_s2)
-        
-        for df_s in [df_s4_sel, df_s2_sel]:
-            df_s['RBD'] = pd.to_numeric(df_s['RBD'], errors='coerce')
-            for c in df_s.columns:
-                if c != 'RBD': df_s[c] = pd.to_numeric(df_s[c], errors='coerce')
-
-        df_s4_sel['SIMCE_4B_AVG'] = df_s4_sel[['SIMCE_4B_LECT', 'SIMCE_4B_MATE']].mean(axis=1)
-        df_s2_sel['SIMCE_2M_AVG'] = df_s2_sel[['SIMCE_2M_LECT', 'SIMCE_2M_MATE']].mean(axis=1)
-
-        df_master = df_master.merge(df_s4_sel, on='RBD', how='left')
-        df_master = df_master.merge(df_s2_sel, on='RBD', how='left')
-
-    except Exception as e:
-        print(f"⚠️ Advertencia SIMCE: {e}")
+    if integrar_simce:
+        print("4. Integrando SIMCE...")
+        try:
+            df_s4_sel = fut_s4.result().rename(columns=COLS_S4)
+            df_s2_sel = fut_s2.result().rename(columns=COLS_S2)
+
+            df_s4_sel['SIMCE_4B_AVG'] = promedio_simce(df_s4_sel['SIMCE_4B_LECT'], df_s4_sel['SIMCE_4B_MATE'])
+            df_s2_sel['SIMCE_2M_AVG'] = promedio_simce(df_s2_sel['SIMCE_2M_LECT'], df_s2_sel['SIMCE_2M_MATE'])
+
+            df_master = (df_master.join(df_s4_sel.set_index('RBD'), how='left')
+                                  .join(df_s2_sel.set_index('RBD'), how='left'))
+
+        except Exception as e:
+            print(f"⚠️ Advertencia SIMCE: {e}")
+
+    df_master = df_master.reset_index()
 
     # -------------------------------------------------------------------------
     # 5. FILTRO GEOGRÁFICO Y REPRESENTATIVIDAD (CORRECCIÓN CRÍTICA)
     # -------------------------------------------------------------------------
-    print("5. Aplicando Filtro Geográfico y Limpieza de 'Retazos'...")
-    n_before = len(df_master)
+    df_final = df_master
+    if filtro_geografico:
+        print("5. Aplicando Filtro Geográfico y Limpieza de 'Retazos'...")
+        n_before = len(df_master)
     
-    # A. Recorte Geográfico (Bounding Box)
-    mask_bbox = (
-        (df_master['LONGITUD'] >= BBOX[0]) & (df_master['LONGITUD'] <= BBOX[2]) & 
-        (df_master['LATITUD'] >= BBOX[1]) & (df_master['LATITUD'] <= BBOX[3])
-    )
-    df_final = df_master[mask_bbox].copy()
+        # A. Recorte Geográfico (Bounding Box)
+        mask_bbox = (
+            (df_master['LONGITUD'] >= BBOX[0]) & (df_master['LONGITUD'] <= BBOX[2]) & 
+            (df_master['LATITUD'] >= BBOX[1]) & (df_master['LATITUD'] <= BBOX[3])
+        )
     
-    # B. Filtro de Representatividad (Eliminar comunas "mutiladas")
-    # Contamos cuántos colegios quedaron por comuna tras el recorte
-    conteo_comunal = df_final['NOM_COM_RBD'].value_counts()
+        # B. Filtro de Representatividad (Eliminar comunas "mutiladas")
+        # Contamos cuántos colegios quedaron por comuna tras el recorte
+        conteo_comunal = df_master.loc[mask_bbox, 'NOM_COM_RBD'].value_counts()
     
-    # Identificamos comunas con más de 3 colegios
-    comunas_validas = conteo_comunal[conteo_comunal > MIN_COLEGIOS_POR_COMUNA].index
-    comunas_eliminadas = conteo_comunal[conteo_comunal <= MIN_COLEGIOS_POR_COMUNA].index.tolist()
+        # Identificamos comunas con más de 3 colegios
+        mask_ok = conteo_comunal > MIN_COLEGIOS_POR_COMUNA
+        comunas_validas = conteo_comunal.index[mask_ok]
+        comunas_eliminadas = conteo_comunal.index[~mask_ok].tolist()
     
-    # Filtramos
-    df_final = df_final[df_final['NOM_COM_RBD'].isin(comunas_validas)].copy()
+        # Filtramos: una sola máscara (BBox y comuna válida), una sola copia
+        # (pertenencia por código categórico: compara enteros en vez de hashear strings)
+        comunas = df_master['NOM_COM_RBD'].astype('category')
+        codigos_validos = np.flatnonzero(comunas.cat.categories.isin(comunas_validas))
+        mask_comuna = np.isin(comunas.cat.codes.to_numpy(), codigos_validos)
+        df_final = df_master[mask_bbox & mask_comuna].copy()
     
-    print(f"   -> Establecimientos en RM: {n_before}")
-    print(f"   -> Establecimientos tras BBox: {mask_bbox.sum()}")
-    print(f"   -> Establecimientos finales (Comunas válidas): {len(df_final)}")
-    print(f"   -> 🗑️ Comunas eliminadas por tener <= {MIN_COLEGIOS_POR_COMUNA} colegios (Retazos):")
-    print(f"      {', '.join(comunas_eliminadas)}")
+        print(f"   -> Establecimientos en RM: {n_before}")
+        print(f"   -> Establecimientos tras BBox: {mask_bbox.sum()}")
+        print(f"   -> Establecimientos finales (Comunas válidas): {len(df_final)}")
+        print(f"   -> 🗑️ Comunas eliminadas por tener <= {MIN_COLEGIOS_POR_COMUNA} colegios (Retazos):")
+        print(f"      {', '.join(comunas_eliminadas)}")
 
     # -------------------------------------------------------------------------
     # 6. GUARDAR
     # -------------------------------------------------------------------------
-    output_path = 'data/processed/base_consolidada_rm_2024_final.csv'
     df_final.to_csv(output_path, index=False)
+    # Copia Parquet (tipada y columnar) para que los análisis no re-parseen el CSV
+    df_final.to_parquet(os.path.splitext(output_path)[0] + '.parquet', compression='snappy', index=False)
     print(f"\n✅ PROCESO COMPLETADO. Archivo maestro actualizado en: {output_path}")
 
 if __name__ == "__main__":
@@ -4,10 +4,13 @@ import seaborn as sns
 import numpy as np
 import os
 from scipy import stats
+from concurrent.futures import ProcessPoolExecutor
+from io_utils import load_base
 
 # --- CONFIGURACIÓN ---
 OUTPUT_DIR_FIG = 'figures/exploratorio'
 OUTPUT_DIR_REP = 'reports'
+DPI_EXPLORE = 150 # Figuras de exploración: no necesitan resolución de impresión (las finales usan 300)
 os.makedirs(OUTPUT_DIR_FIG, exist_ok=True)
 os.makedirs(OUTPUT_DIR_REP, exist_ok=True)
 
@@ -18,63 +21,21 @@ COLOR_PAID = '#d62728'  # Rojo
 
 # Función auxiliar para Estadísticas (R)
 def get_r(df, col_x, col_y):
-    clean = df[[col_x, col_y]].dropna()
-    if len(clean) > 2:
-        r, _ = stats.pearsonr(clean[col_x], clean[col_y])
-        return r
+    # Solo hace falta r (no el p-valor): máscara sobre los arrays en vez de dropna() + scipy
+    x = df[col_x].to_numpy(dtype=np.float64)
+    y = df[col_y].to_numpy(dtype=np.float64)
+    ok = ~(np.isnan(x) | np.isnan(y))
+    if ok.sum() > 2:
+        return np.corrcoef(x[ok], y[ok])[0, 1]
     return 0.0
 
-def main():
-    print(">>> INICIANDO ANÁLISIS EXPLORATORIO CONSOLIDADO (Bloque 2) <<<")
-    
-    # 1. Cargar Datos Consolidados (del Bloque 1)
-    try:
-        df = pd.read_csv('data/processed/base_consolidada_rm_2024_final.csv')
-        print(f"Datos cargados: {len(df)} registros.")
-    except FileNotFoundError:
-        print("❌ Error: No se encontró 'data/processed/base_consolidada_rm_2024_final.csv'. Ejecuta el Bloque 1 primero.")
-        return
-
-    # -------------------------------------------------------------------------
-    # 2. GENERACIÓN DE REPORTE DE TEXTO UNIFICADO
-    # -------------------------------------------------------------------------
-    print("Generando reporte estadístico de texto...")
-    
-    with open(f'{OUTPUT_DIR_REP}/hallazgos_exploratorios.txt', 'w', encoding='utf-8') as f:
-        f.write("REPORTE CONSOLIDADO DE HALLAZGOS - BRECHA EDUCATIVA RM\n")
-        f.write("======================================================\n\n")
+# -------------------------------------------------------------------------
+# GRÁFICOS (cada uno corre en su propio proceso)
+# -------------------------------------------------------------------------
 
-        # A. Desigualdad Intra-comunal
-        stats_comuna = df.groupby('NOM_COM_RBD')['ratio_alumno_docente'].agg(['mean', 'std', 'count'])
-        top_desigualdad = stats_comuna[stats_comuna['count'] > 10].sort_values('std', ascending=False).head(10)
-        
-        f.write("1. TOP 10 COMUNAS CON MAYOR DESIGUALDAD INTERNA (Std Dev Ratio Alumno/Docente):\n")
-        f.write(top_desigualdad.to_string())
-        f.write("\n\n")
-
-        # B. Estadísticas por Tipo de Pago
-        stats_pago = df.groupby('TIPO_PAGO')[['ratio_alumno_docente', 'ratio_alumno_curso']].describe()
-        f.write("2. COMPARATIVA GRATUITO VS PAGADO:\n")
-        f.write(stats_pago.to_string())
-        f.write("\n\n")
-
-        # C. Correlaciones
-        corr_cols = ['ratio_alumno_docente', 'ratio_alumno_curso', 'MAT_TOTAL', 'orden_precio']
-        corr_mat = df[corr_cols].corr()
-        f.write("3. MATRIZ DE CORRELACIÓN GENERAL:\n")
-        f.write(corr_mat.to_string())
-
-    # -------------------------------------------------------------------------
-    # 3. GRÁFICOS CONSOLIDADOS (Reglas Aplicadas)
-    # -------------------------------------------------------------------------
-    
-    # GRÁFICO 1: Ranking de Desigualdad Comunal (Boxplot)
-    # ---------------------------------------------------
-    print("Generando Gráfico 1: Ranking Comunal...")
+# GRÁFICO 1: Ranking de Desigualdad Comunal (Boxplot)
+def grafico_ranking_comunal(df, order):
     plt.figure(figsize=(16, 10))
-    # Ordenar por mediana
-    order = df.groupby('NOM_COM_RBD')['ratio_alumno_docente'].median().sort_values().index
-    
     sns.boxplot(data=df, x='NOM_COM_RBD', y='ratio_alumno_docente', order=order, palette="viridis", linewidth=1)
     
     plt.xticks(rotation=90, fontsize=8)
@@ -85,30 +46,34 @@ def main():
     # REGLA: Marco visible
     plt.box(True) 
     plt.tight_layout()
-    plt.savefig(f'{OUTPUT_DIR_FIG}/01_ranking_comunal_ratio.png', dpi=300)
+    plt.savefig(f'{OUTPUT_DIR_FIG}/01_ranking_comunal_ratio.png', dpi=DPI_EXPLORE)
     plt.close()
 
-    # GRÁFICO 2: Densidad por Tipo de Pago (Rojo vs Verde)
-    # ----------------------------------------------------
-    print("Generando Gráfico 2: Densidad Pagado vs Gratuito...")
+# GRÁFICO 2: Densidad por Tipo de Pago (Rojo vs Verde)
+def grafico_densidad_pago(df):
     plt.figure(figsize=(12, 7))
     
-    sns.kdeplot(data=df, x='ratio_alumno_docente', hue='TIPO_PAGO', fill=True, common_norm=False,
-                palette={'Gratuito': COLOR_FREE, 'Pagado': COLOR_PAID}, alpha=0.3, linewidth=2)
+    # KDE explícito (Scott, igual que seaborn) evaluado en una grilla común para ambos grupos
+    grid = np.linspace(0, 45, 512)
+    for tipo, color in [('Gratuito', COLOR_FREE), ('Pagado', COLOR_PAID)]:
+        valores = df.loc[df['TIPO_PAGO'] == tipo, 'ratio_alumno_docente'].dropna().to_numpy()
+        densidad = stats.gaussian_kde(valores)(grid)
+        plt.fill_between(grid, densidad, color=color, alpha=0.3, label=tipo)
+        plt.plot(grid, densidad, color=color, linewidth=2)
+    plt.legend(title='TIPO_PAGO')
+    plt.ylabel('Density')
     
     plt.title('Comparación de Densidad: Carga Docente por Financiamiento', fontsize=14)
     plt.xlim(0, 45)
     plt.xlabel('Ratio Alumnos/Docente')
     plt.box(True) # Marco
     plt.tight_layout()
-    plt.savefig(f'{OUTPUT_DIR_FIG}/02_densidad_pago.png', dpi=300)
+    plt.savefig(f'{OUTPUT_DIR_FIG}/02_densidad_pago.png', dpi=DPI_EXPLORE)
     plt.close()
 
-    # GRÁFICO 3: Impacto Precio (Blues)
-    # ----------------------------------------------------
-    print("Generando Gráfico 3: Impacto Precio...")
+# GRÁFICO 3: Impacto Precio (Blues)
+def grafico_impacto_precio(df_precios):
     plt.figure(figsize=(12, 8))
-    df_precios = df[df['orden_precio'] >= 0].copy()
     orden_precios = ['GRATUITO', '$1.000 A $10.000', '$10.001 A $25.000', '$25.001 A $50.000', '$50.001 A $100.000', 'MAS DE $100.000']
     
     sns.boxplot(data=df_precios, x='PAGO_MENSUAL', y='ratio_alumno_docente', order=orden_precios, palette="Blues")
@@ -117,20 +82,23 @@ def main():
     plt.title('Relación Precio vs. Carga Docente', fontsize=14)
     plt.box(True) # Marco
     plt.tight_layout()
-    plt.savefig(f'{OUTPUT_DIR_FIG}/03_impacto_precio.png', dpi=300)
+    plt.savefig(f'{OUTPUT_DIR_FIG}/03_impacto_precio.png', dpi=DPI_EXPLORE)
     plt.close()
 
-    # GRÁFICO 4: Matriz de Calidad (Scatter School Level)
-    # ----------------------------------------------------
-    # REGLA: Rojo vs Verde, Marco, R value
-    print("Generando Gráfico 4: Matriz Calidad (School Level)...")
+# GRÁFICO 4: Matriz de Calidad (Scatter School Level)
+# REGLA: Rojo vs Verde, Marco, R value
+def grafico_matriz_calidad(df_clean, r_val):
     plt.figure(figsize=(12, 8))
     
-    df_clean = df[(df['ratio_alumno_docente'] < 50) & (df['ratio_alumno_curso'] < 60)].copy()
-    r_val = get_r(df_clean, 'ratio_alumno_docente', 'ratio_alumno_curso')
-    
-    sns.scatterplot(data=df_clean, x='ratio_alumno_docente', y='ratio_alumno_curso', 
-                    hue='TIPO_PAGO', palette={'Gratuito': COLOR_FREE, 'Pagado': COLOR_PAID}, alpha=0.6)
+    # Un punto por colegio, coloreado por tipo de pago. Un solo scatter con color por punto en vez de
+    # sns.scatterplot: se dibuja en el orden de los datos (el solapamiento no cambia) sin el mapeo de seaborn
+    from matplotlib.lines import Line2D
+    colores = np.where(df_clean['TIPO_PAGO'] == 'Pagado', COLOR_PAID, COLOR_FREE)
+    plt.scatter(df_clean['ratio_alumno_docente'], df_clean['ratio_alumno_curso'], c=colores, alpha=0.6,
+                edgecolors='white', linewidths=0.75)
+    leyenda = [Line2D([0], [0], marker='o', color='w', label=tipo, markerfacecolor=color, markersize=7, alpha=0.6)
+               for tipo, color in [('Gratuito', COLOR_FREE), ('Pagado', COLOR_PAID)]]
+    plt.legend(handles=leyenda, title='TIPO_PAGO')
     
     # Cuadrantes promedio
     plt.axvline(df_clean['ratio_alumno_docente'].mean(), color='gray', linestyle='--', alpha=0.5)
@@ -141,23 +109,11 @@ def main():
     plt.ylabel('Alumnos por Curso')
     plt.box(True) # Marco
     plt.tight_layout()
-    plt.savefig(f'{OUTPUT_DIR_FIG}/04_matriz_calidad_escuelas.png', dpi=300)
+    plt.savefig(f'{OUTPUT_DIR_FIG}/04_matriz_calidad_escuelas.png', dpi=DPI_EXPLORE)
     plt.close()
 
-    # GRÁFICO 5: Vulnerabilidad Comunal (Scatter Commune Level)
-    # ---------------------------------------------------------
-    print("Generando Gráfico 5: Vulnerabilidad Comunal...")
-    # Agregación comunal
-    df['IS_PAID'] = df['TIPO_PAGO'].apply(lambda x: 1 if x == 'Pagado' else 0)
-    comunal = df.groupby('NOM_COM_RBD').agg({
-        'ratio_alumno_docente': ['mean', 'std'],
-        'MAT_TOTAL': 'sum',
-        'IS_PAID': 'mean' # % de colegios pagados
-    }).reset_index()
-    comunal.columns = ['NOM_COM_RBD', 'ratio_mean', 'ratio_std', 'matricula', 'pct_paid']
-    
-    r_vul = get_r(comunal, 'ratio_mean', 'ratio_std')
-    
+# GRÁFICO 5: Vulnerabilidad Comunal (Scatter Commune Level)
+def grafico_vulnerabilidad_comunal(comunal, r_vul):
     plt.figure(figsize=(14, 10))
     # Usamos un gradiente de Verde (0% pagado) a Rojo (100% pagado)
     # cmap='RdYlGn_r' (Red-Yellow-Green reversed -> Green low, Red high)
@@ -168,18 +124,101 @@ def main():
     plt.colorbar(scatter, label='% Oferta Pagada (Verde=0%, Rojo=100%)')
     
     # Etiquetas extremos
-    for _, row in comunal.iterrows():
-        if row['ratio_std'] > 6 or row['ratio_mean'] > 20 or row['matricula'] > 40000:
-            plt.text(row['ratio_mean']+0.2, row['ratio_std'], row['NOM_COM_RBD'], fontsize=9)
+    extremos = comunal[(comunal['ratio_std'] > 6) | (comunal['ratio_mean'] > 20) | (comunal['matricula'] > 40000)]
+    for row in extremos.itertuples(index=False):
+        plt.text(row.ratio_mean+0.2, row.ratio_std, row.NOM_COM_RBD, fontsize=9)
 
     plt.title(f'Vulnerabilidad Comunal: Calidad vs Desigualdad (R={r_vul:.2f})', fontsize=16)
     plt.xlabel('Promedio Alumnos/Docente')
     plt.ylabel('Desigualdad Interna (Std Dev)')
     plt.box(True) # Marco
     plt.tight_layout()
-    plt.savefig(f'{OUTPUT_DIR_FIG}/05_vulnerabilidad_comunal.png', dpi=300)
+    plt.savefig(f'{OUTPUT_DIR_FIG}/05_vulnerabilidad_comunal.png', dpi=DPI_EXPLORE)
     plt.close()
 
+def main():
+    print(">>> INICIANDO ANÁLISIS EXPLORATORIO CONSOLIDADO (Bloque 2) <<<")
+    
+    # 1. Cargar Datos Consolidados (del Bloque 1)
+    try:
+        df = load_base('data/processed/base_consolidada_rm_2024_final.csv',
+                       usecols=['NOM_COM_RBD', 'TIPO_PAGO', 'PAGO_MENSUAL', 'MAT_TOTAL', 'orden_precio',
+                                'ratio_alumno_docente', 'ratio_alumno_curso'])
+        print(f"Datos cargados: {len(df)} registros.")
+    except FileNotFoundError:
+        print("❌ Error: No se encontró 'data/processed/base_consolidada_rm_2024_final.csv'. Ejecuta el Bloque 1 primero.")
+        return
+
+    # Agregación comunal única: la reutilizan el reporte (A), el ranking (Gráfico 1) y la vulnerabilidad (Gráfico 5)
+    df['IS_PAID'] = (df['TIPO_PAGO'].to_numpy() == 'Pagado').astype(np.int8)
+    agg_comuna = df.groupby('NOM_COM_RBD', observed=True, sort=False).agg(
+        ratio_mean=('ratio_alumno_docente', 'mean'),
+        ratio_std=('ratio_alumno_docente', 'std'),
+        ratio_median=('ratio_alumno_docente', 'median'),
+        count=('ratio_alumno_docente', 'count'),
+        matricula=('MAT_TOTAL', 'sum'),
+        pct_paid=('IS_PAID', 'mean') # % de colegios pagados
+    )
+
+    # -------------------------------------------------------------------------
+    # 2. GENERACIÓN DE REPORTE DE TEXTO UNIFICADO
+    # -------------------------------------------------------------------------
+    print("Generando reporte estadístico de texto...")
+    
+    with open(f'{OUTPUT_DIR_REP}/hallazgos_exploratorios.txt', 'w', encoding='utf-8') as f:
+        f.write("REPORTE CONSOLIDADO DE HALLAZGOS - BRECHA EDUCATIVA RM\n")
+        f.write("======================================================\n\n")
+
+        # A. Desigualdad Intra-comunal
+        stats_comuna = agg_comuna[['ratio_mean', 'ratio_std', 'count']].rename(columns={'ratio_mean': 'mean', 'ratio_std': 'std'})
+        top_desigualdad = stats_comuna[stats_comuna['count'] > 10].sort_values('std', ascending=False).head(10)
+        
+        f.write("1. TOP 10 COMUNAS CON MAYOR DESIGUALDAD INTERNA (Std Dev Ratio Alumno/Docente):\n")
+        f.write(top_desigualdad.to_string())
+        f.write("\n\n")
+
+        # B. Estadísticas por Tipo de Pago
+        stats_pago = df.groupby('TIPO_PAGO', observed=True)[['ratio_alumno_docente', 'ratio_alumno_curso']].describe()
+        f.write("2. COMPARATIVA GRATUITO VS PAGADO:\n")
+        f.write(stats_pago.to_string())
+        f.write("\n\n")
+
+        # C. Correlaciones
+        corr_cols = ['ratio_alumno_docente', 'ratio_alumno_curso', 'MAT_TOTAL', 'orden_precio']
+        corr_mat = df[corr_cols].corr()
+        f.write("3. MATRIZ DE CORRELACIÓN GENERAL:\n")
+        f.write(corr_mat.to_string())
+
+    # -------------------------------------------------------------------------
+    # 3. GRÁFICOS CONSOLIDADOS (Reglas Aplicadas)
+    # -------------------------------------------------------------------------
+    # Los 5 gráficos son independientes: se renderizan en procesos separados.
+    # Cada worker recibe solo el recorte (pequeño) de datos que necesita.
+    df_precios = df.loc[df['orden_precio'] >= 0, ['PAGO_MENSUAL', 'ratio_alumno_docente']]
+    df_clean = df.loc[(df['ratio_alumno_docente'] < 50) & (df['ratio_alumno_curso'] < 60),
+                      ['ratio_alumno_docente', 'ratio_alumno_curso', 'TIPO_PAGO']]
+    comunal = agg_comuna[['ratio_mean', 'ratio_std', 'matricula', 'pct_paid']].reset_index()
+
+    tareas = [
+        ("Generando Gráfico 1: Ranking Comunal...", grafico_ranking_comunal,
+         (df[['NOM_COM_RBD', 'ratio_alumno_docente']], agg_comuna['ratio_median'].sort_values().index)),
+        ("Generando Gráfico 2: Densidad Pagado vs Gratuito...", grafico_densidad_pago,
+         (df[['ratio_alumno_docente', 'TIPO_PAGO']],)),
+        ("Generando Gráfico 3: Impacto Precio...", grafico_impacto_precio, (df_precios,)),
+        ("Generando Gráfico 4: Matriz Calidad (School Level)...", grafico_matriz_calidad,
+         (df_clean, get_r(df_clean, 'ratio_alumno_docente', 'ratio_alumno_curso'))),
+        ("Generando Gráfico 5: Vulnerabilidad Comunal...", grafico_vulnerabilidad_comunal,
+         (comunal, get_r(comunal, 'ratio_mean', 'ratio_std'))),
+    ]
+    with ProcessPoolExecutor(max_workers=min(len(tareas), os.cpu_count() or 1),
+                             initializer=plt.switch_backend, initargs=('Agg',)) as ex:
+        futuros = []
+        for mensaje, funcion, args in tareas:
+            print(mensaje)
+            futuros.append(ex.submit(funcion, *args))
+        for fut in futuros:
+            fut.result() # propaga errores de los workers
+
     print(f"\n✅ PROCESO COMPLETADO. Gráficos en: {OUTPUT_DIR_FIG}")
 
 if __name__ == "__main__":
@@ -3,10 +3,11 @@ import geopandas as gpd
 import matplotlib.pyplot as plt
 import matplotlib.patheffects as pe
 import seaborn as sns
-import unicodedata
+import numpy as np
 import os
-import requests
-from shapely.geometry import box
+from build_geo_cache import cargar_comunas_urbano, descargar_shapefile
+from map_utils import parche_poligono, aspecto_geografico, dibujar_coropletas, etiquetas_comunas, anotar_comunas
+from io_utils import load_base
 
 # --- CONFIGURACIÓN GLOBAL ---
 OUTPUT_DIR = 'figures/finales'
@@ -20,58 +21,38 @@ COLOR_PAID = '#d62728'  # Rojo (Pagado)
 # Bounding Box Urbano
 BBOX_COORDS = [-70.872116, -33.642527, -70.469742, -33.327552]
 
-def normalizar_texto(texto):
-    """Normaliza nombres para cruces de datos."""
-    if pd.isna(texto): return ""
-    texto = str(texto).upper()
-    texto = unicodedata.normalize('NFD', texto)
-    texto = u"".join([c for c in texto if unicodedata.category(c) != 'Mn'])
-    return texto.strip()
-
-def descargar_shapefile():
-    """Gestión automática del mapa base."""
-    output_dir = 'data/external/comunas_hito2'
-    os.makedirs(output_dir, exist_ok=True)
-    base_url = "https://github.com/PLUMAS-research/visualization-course-materials/raw/master/data/comunas_rm/COMUNA_C17"
-    shp_path = f"{output_dir}/COMUNA_C17.shp"
-    
-    if not os.path.exists(shp_path):
-        print("⬇️ Descargando mapa base...")
-        for ext in ['.shp', '.shx', '.dbf', '.prj', '.cpg']:
-            try:
-                r = requests.get(f"{base_url}{ext}", allow_redirects=True)
-                if r.status_code == 200:
-                    with open(f"{output_dir}/COMUNA_C17{ext}", 'wb') as f:
-                        f.write(r.content)
-            except Exception: pass
-    return shp_path
-
 def main():
     print(">>> INICIANDO ANÁLISIS DE SEGREGACIÓN Y MERCADO (Bloque 4) <<<")
     
     # 1. Cargar Datos
     try:
-        df = pd.read_csv('data/processed/base_consolidada_rm_2024_final.csv')
+        df = load_base('data/processed/base_consolidada_rm_2024_final.csv',
+                       usecols=['RBD', 'NOM_COM_RBD', 'PAGO_MENSUAL', 'MAT_TOTAL', 'DC_TOT'], categoricas=False)
         print(f"Datos cargados: {len(df)} registros.")
     except FileNotFoundError:
         print("❌ Error: Ejecuta el Bloque 1 primero.")
         return
 
+    # Orden de comunas por n° de colegios (sobre el texto original, para conservar el desempate)
+    orden = df['NOM_COM_RBD'].value_counts().index
+    # Llaves de agrupación como categóricas: el groupby trabaja sobre códigos enteros
+    df['PAGO_MENSUAL'] = df['PAGO_MENSUAL'].astype('string').str.strip().str.upper().astype('category')
+    df['NOM_COM_RBD'] = df['NOM_COM_RBD'].astype('category')
+
     # 2. Clasificación Binaria
-    df['TIPO_PAGO'] = df['PAGO_MENSUAL'].apply(
-        lambda x: 'Gratuito' if str(x).strip().upper() == 'GRATUITO' or 'MUNICIPAL' in str(x).upper() else 'Pagado'
-    )
+    pago = df['PAGO_MENSUAL']
+    df['TIPO_PAGO'] = pd.Categorical(np.where((pago == 'GRATUITO') | pago.str.contains('MUNICIPAL', na=False),
+                                              'Gratuito', 'Pagado'))
 
     # -------------------------------------------------------------------------
     # PARTE A: ANÁLISIS DE MERCADO (Volumen)
     # -------------------------------------------------------------------------
     print("A. Generando Gráficos de Mercado (Barras)...")
     
-    mercado = df.groupby(['NOM_COM_RBD', 'TIPO_PAGO']).agg({
+    mercado = df.groupby(['NOM_COM_RBD', 'TIPO_PAGO'], observed=True).agg({
         'RBD': 'count', 'MAT_TOTAL': 'mean'
     }).reset_index()
     mercado.columns = ['Comuna', 'Tipo', 'Cantidad', 'Tamano_Promedio']
-    orden = df['NOM_COM_RBD'].value_counts().index
 
     # GRÁFICO 1: Oferta (Cantidad)
     plt.figure(figsize=(16, 8))
@@ -96,12 +77,17 @@ def main():
     print("B. Generando Gráfico de Sobrerrepresentación (Oferta vs Demanda)...")
     
     # Calcular totales por comuna para sacar porcentajes
-    comuna_agg = df.groupby('NOM_COM_RBD').apply(lambda x: pd.Series({
-        'Total_Colegios': len(x),
-        'Total_Matricula': x['MAT_TOTAL'].sum(),
-        'Col_Pagados': (x['TIPO_PAGO'] == 'Pagado').sum(),
-        'Mat_Pagada': x.loc[x['TIPO_PAGO'] == 'Pagado', 'MAT_TOTAL'].sum()
-    }))
+    # Agregación nativa (sin lambda por grupo): indicador de pago y matrícula pagada precalculados
+    df['IS_PAID_INT'] = (df['TIPO_PAGO'] == 'Pagado').astype(np.int8)
+    df['MAT_PAID'] = df['MAT_TOTAL'] * df['IS_PAID_INT']
+    comuna_agg = df.groupby('NOM_COM_RBD', observed=True).agg(
+        Total_Colegios=('RBD', 'size'),
+        Total_Matricula=('MAT_TOTAL', 'sum'),
+        Col_Pagados=('IS_PAID_INT', 'sum'),
+        Mat_Pagada=('MAT_PAID', 'sum')
+    )
+    # La suma de un int8 sigue en int8 si cabe: el conteo se sube a int64 antes de operar
+    comuna_agg['Col_Pagados'] = comuna_agg['Col_Pagados'].astype(np.int64)
     
     # Calcular % Pagado en Oferta (Colegios) vs Demanda (Alumnos)
     comuna_agg['% Oferta Pagada'] = comuna_agg['Col_Pagados'] / comuna_agg['Total_Colegios']
@@ -148,41 +134,40 @@ def main():
     # -------------------------------------------------------------------------
     print("C. Generando Mapas Comparativos...")
     
-    geo_agg = df.groupby(['NOM_COM_RBD', 'TIPO_PAGO'])[['MAT_TOTAL', 'DC_TOT']].sum().reset_index()
+    # Comuna como código entero (el de la categórica): pivot y merge con el mapa sobre int32, no sobre texto
+    comunas = df['NOM_COM_RBD'].cat.categories
+    com_code = df['NOM_COM_RBD'].cat.codes.astype(np.int32).rename('COM_CODE')
+    geo_agg = df.groupby([com_code, 'TIPO_PAGO'], observed=True)[['MAT_TOTAL', 'DC_TOT']].sum().reset_index()
+    geo_agg = geo_agg[geo_agg['COM_CODE'] >= 0] # -1 = comuna vacía
     geo_agg['RATIO_REAL'] = geo_agg['MAT_TOTAL'] / geo_agg['DC_TOT']
-    map_pivot = geo_agg.pivot(index='NOM_COM_RBD', columns='TIPO_PAGO', values='RATIO_REAL').reset_index()
+    map_pivot = geo_agg.pivot(index='COM_CODE', columns='TIPO_PAGO', values='RATIO_REAL').reset_index()
     
     shp_path = descargar_shapefile()
     if os.path.exists(shp_path):
         try:
-            gdf = gpd.read_file(shp_path)
-            if gdf.crs.to_string() != "EPSG:4326": gdf = gdf.to_crs(epsg=4326)
-            
-            col_name = 'NOM_COMUNA' if 'NOM_COMUNA' in gdf.columns else gdf.columns[0]
-            gdf['nombre_norm'] = gdf[col_name].apply(normalizar_texto)
-            
-            zona_urbana = box(BBOX_COORDS[0], BBOX_COORDS[1], BBOX_COORDS[2], BBOX_COORDS[3])
-            gdf_zoom = gpd.clip(gdf, zona_urbana)
-            gdf_final = gdf_zoom.merge(map_pivot, left_on='nombre_norm', right_on='NOM_COM_RBD', how='left')
+            gdf_zoom = cargar_comunas_urbano(BBOX_COORDS, shp_path) # EPSG:4326, 'nombre_norm' y recortado (caché Feather)
+            gdf_zoom['COM_CODE'] = pd.Index(comunas).get_indexer(gdf_zoom['nombre_norm']).astype(np.int32) # -1 = sin datos
+            gdf_final = gdf_zoom.merge(map_pivot, on='COM_CODE', how='left')
             
             fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 10), sharex=True, sharey=True)
             vmin, vmax = 15, 35 
             
-            for ax, col, title, color_t in [(ax1, 'Gratuito', 'Sector GRATUITO', COLOR_FREE), 
-                                            (ax2, 'Pagado', 'Sector PAGADO', COLOR_PAID)]:
-                gdf_final.plot(column=col, ax=ax, cmap='magma_r', vmin=vmin, vmax=vmax, 
-                              legend=True, legend_kwds={'shrink': 0.4}, edgecolor='gray', linewidth=0.5,
-                              missing_kwds={'color': 'lightgrey'})
+            # Polígonos convertidos una sola vez; cada mapa solo cambia el color (escala compartida)
+            parches = [parche_poligono(g) for g in gdf_final.geometry]
+            dibujar_coropletas([ax1, ax2], parches, [gdf_final['Gratuito'], gdf_final['Pagado']], 'magma_r', vmin, vmax,
+                               shrink=0.4, hatch=None, edgecolor='gray', linewidth=0.5)
+            
+            # Etiquetas: centroides y áreas en una sola llamada vectorizada, se reutilizan en ambos mapas
+            textos = gdf_final['nombre_norm'].str.title().str.replace("Santiago", "Stgo")
+            anotar_comunas([ax1, ax2], etiquetas_comunas(gdf_final, textos, area_min=0.0015),
+                           ha='center', fontsize=8, path_effects=[pe.withStroke(linewidth=2, foreground="white")])
+            
+            for ax, title, color_t in [(ax1, 'Sector GRATUITO', COLOR_FREE), (ax2, 'Sector PAGADO', COLOR_PAID)]:
+                ax.set_aspect(aspecto_geografico(gdf_final))
                 ax.set_title(title, fontsize=16, fontweight='bold', color=color_t); ax.axis('off')
-                
-                for _, row in gdf_final.iterrows():
-                    if row.geometry.area > 0.0015:
-                        txt = row['nombre_norm'].title().replace("Santiago", "Stgo")
-                        ax.annotate(txt, xy=(row.geometry.centroid.x, row.geometry.centroid.y),
-                                    ha='center', fontsize=8, path_effects=[pe.withStroke(linewidth=2, foreground="white")])
 
             plt.suptitle('Brecha Territorial: Carga Docente Real', fontsize=20, y=0.95); plt.tight_layout()
-            plt.savefig(f'{OUTPUT_DIR}/11_mapa_comparativo_segregacion.png', dpi=300); plt.close()
+            plt.savefig(f'{OUTPUT_DIR}/11_mapa_comparativo_segregacion.pdf', dpi=300); plt.close()
         except Exception as e: print(f"⚠️ Error mapas: {e}")
 
     print(f"✅ Gráficos generados en: {OUTPUT_DIR}")
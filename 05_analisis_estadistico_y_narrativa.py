@@ -3,7 +3,7 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 import os
-from scipy import stats
+from io_utils import load_base
 
 # --- CONFIGURACIÓN GLOBAL ---
 OUTPUT_DIR = 'figures/finales'
@@ -16,29 +16,50 @@ COLOR_PAID = '#d62728'  # Rojo (Pagado)
 
 def get_r(df, col_x, col_y):
     """Calcula correlación de Pearson ignorando NaNs."""
-    clean = df[[col_x, col_y]].dropna()
-    if len(clean) > 2:
-        r, p = stats.pearsonr(clean[col_x], clean[col_y])
-        return r
+    # Solo hace falta r (no el p-valor): máscara sobre los arrays en vez de dropna() + scipy
+    x = df[col_x].to_numpy(dtype=np.float64)
+    y = df[col_y].to_numpy(dtype=np.float64)
+    ok = ~(np.isnan(x) | np.isnan(y))
+    if ok.sum() > 2:
+        return np.corrcoef(x[ok], y[ok])[0, 1]
     return 0.0
 
+def corr_pairwise(arr):
+    """
+    Matriz de Pearson con exclusión de NaN por pares (igual que DataFrame.corr()),
+    calculada con productos matriciales sobre el array en vez de columna a columna.
+    """
+    arr = arr - np.nanmean(arr, axis=0) # centrar no cambia r y evita cancelación numérica
+    ok = (~np.isnan(arr)).astype(np.float64)
+    x = np.where(ok > 0, arr, 0.0)
+    n = ok.T @ ok                       # observaciones comunes de cada par
+    sx = x.T @ ok                       # suma de la col. i sobre las filas válidas para j
+    sxx = (x * x).T @ ok
+    sxy = x.T @ x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sxy - sx * sx.T / n
+        var_i = sxx - sx ** 2 / n
+        r = cov / np.sqrt(var_i * var_i.T)
+    return np.clip(r, -1, 1)
+
 def main():
     print(">>> INICIANDO ANÁLISIS ESTADÍSTICO FINAL (Bloque 5 Corregido) <<<")
     
     # 1. Cargar Datos Procesados
     try:
-        df = pd.read_csv('data/processed/base_consolidada_rm_2024_final.csv')
+        df = load_base('data/processed/base_consolidada_rm_2024_final.csv',
+                       usecols=['NOM_COM_RBD', 'PAGO_MENSUAL', 'MAT_TOTAL', 'ratio_alumno_docente', 'ratio_alumno_curso',
+                                'orden_precio', 'SIMCE_4B_AVG', 'SIMCE_2M_AVG'], categoricas=False)
         print(f"Datos cargados: {len(df)} registros.")
     except FileNotFoundError:
         print("❌ Error: Ejecuta el Bloque 1 primero.")
         return
 
     # Clasificación Binaria Consistente
-    df['TIPO_PAGO'] = df['PAGO_MENSUAL'].apply(
-        lambda x: 'Gratuito' if str(x).strip().upper() == 'GRATUITO' or 'MUNICIPAL' in str(x).upper() else 'Pagado'
-    )
+    pago = df['PAGO_MENSUAL'].astype(str).str.strip().str.upper()
+    df['TIPO_PAGO'] = np.where((pago == 'GRATUITO') | pago.str.contains('MUNICIPAL', regex=False), 'Gratuito', 'Pagado')
     # Variable Dummy para Correlaciones (0=Gratuito, 1=Pagado)
-    df['IS_PAID'] = df['TIPO_PAGO'].apply(lambda x: 1 if x == 'Pagado' else 0)
+    df['IS_PAID'] = (df['TIPO_PAGO'] == 'Pagado').astype(np.int8)
 
     # -------------------------------------------------------------------------
     # PARTE A: MATRICES DE CORRELACIÓN
@@ -55,7 +76,9 @@ def main():
         'SIMCE_2M_AVG': 'SIMCE IIM'
     }
     
-    df_corr = df[cols_corr.keys()].rename(columns=cols_corr).corr()
+    arr = np.ascontiguousarray(df[list(cols_corr)].to_numpy(dtype=np.float64))
+    etiquetas = list(cols_corr.values())
+    df_corr = pd.DataFrame(corr_pairwise(arr), index=etiquetas, columns=etiquetas)
     
     plt.figure(figsize=(10, 8))
     sns.heatmap(df_corr, annot=True, cmap='RdBu_r', vmin=-1, vmax=1, fmt=".2f", linewidths=0.5)
@@ -75,31 +98,43 @@ def main():
         {'col': 'SIMCE_2M_AVG', 'nombre': 'II Medio', 'file_tag': '2m'}
     ]
 
+    # Una sola pasada por la base para las partes B y C: sumas y conteos por Comuna x Tipo de Pago.
+    # Los promedios comunales (B) y por tipo (C) de cada nivel salen de re-sumar esta tabla chica.
+    aggs = {'N': ('IS_PAID', 'size'), 'N_PAGADO': ('IS_PAID', 'sum')}
+    for nivel in niveles:
+        aggs[f"S_{nivel['col']}"] = (nivel['col'], 'sum')
+        aggs[f"C_{nivel['col']}"] = (nivel['col'], 'count')
+    por_tipo = df.groupby(['NOM_COM_RBD', 'TIPO_PAGO']).agg(**aggs)
+    por_comuna = por_tipo.groupby(level='NOM_COM_RBD').sum()
+
     for nivel in niveles:
         col_simce = nivel['col']
         nombre_nivel = nivel['nombre']
         tag = nivel['file_tag']
         
         # Agregación Comunal Específica para este nivel
-        comuna_stats = df.groupby('NOM_COM_RBD').apply(lambda x: pd.Series({
-            'PCT_PAGADO': x['IS_PAID'].mean() * 100, # % Oferta Pagada
-            'SIMCE_PROM': x[col_simce].mean()        # Promedio del nivel
-        })).dropna()
+        comuna_stats = pd.DataFrame({
+            'PCT_PAGADO': por_comuna['N_PAGADO'] / por_comuna['N'],                  # % Oferta Pagada
+            'SIMCE_PROM': por_comuna[f'S_{col_simce}'] / por_comuna[f'C_{col_simce}']  # Promedio del nivel
+        }).dropna()
+        comuna_stats['PCT_PAGADO'] *= 100
         
         r_val = get_r(comuna_stats, 'PCT_PAGADO', 'SIMCE_PROM')
         
         plt.figure(figsize=(12, 8))
         sns.regplot(
-            data=comuna_stats, x='PCT_PAGADO', y='SIMCE_PROM',
+            data=comuna_stats, x='PCT_PAGADO', y='SIMCE_PROM', ci=None, # sin bootstrap del intervalo: solo la recta
             scatter_kws={'s': 100, 'alpha': 0.6, 'color': '#555555'},
             line_kws={'color': COLOR_PAID, 'label': f'Regresión (R={r_val:.2f})'}
         )
         
-        # Etiquetas para casos extremos
-        for idx, row in comuna_stats.iterrows():
-            # Criterios de etiqueta ajustados al nivel
-            if row['PCT_PAGADO'] > 80 or row['SIMCE_PROM'] > 280 or row['SIMCE_PROM'] < 230:
-                plt.text(row['PCT_PAGADO']+1, row['SIMCE_PROM'], idx, fontsize=9)
+        # Etiquetas para casos extremos (criterios ajustados al nivel; filtro vectorizado,
+        # solo se recorren las comunas etiquetadas)
+        px = comuna_stats['PCT_PAGADO'].to_numpy()
+        py = comuna_stats['SIMCE_PROM'].to_numpy()
+        extremo = (px > 80) | (py > 280) | (py < 230)
+        for nombre, x, y in zip(comuna_stats.index[extremo], px[extremo], py[extremo]):
+            plt.text(x + 1, y, nombre, fontsize=9)
                 
         plt.title(f'Segregación vs Calidad Comunal ({nombre_nivel})', fontsize=16)
         plt.xlabel('Porcentaje de Oferta Pagada en la Comuna (%)')
@@ -120,8 +155,8 @@ def main():
         nombre_nivel = nivel['nombre']
         tag = nivel['file_tag']
 
-        # Calcular brecha por comuna para este nivel
-        gap_stats = df.groupby(['NOM_COM_RBD', 'TIPO_PAGO'])[col_simce].mean().unstack()
+        # Calcular brecha por comuna para este nivel (desde la agregación ya hecha)
+        gap_stats = (por_tipo[f'S_{col_simce}'] / por_tipo[f'C_{col_simce}']).unstack()
         
         if 'Pagado' in gap_stats and 'Gratuito' in gap_stats:
             gap_stats['Brecha'] = gap_stats['Pagado'] - gap_stats['Gratuito']
@@ -146,9 +181,14 @@ def main():
     # -------------------------------------------------------------------------
     print("D. Generando Gráficos de Distribución...")
     
+    # Solo las columnas que usan estos gráficos; los filtros de outliers se calculan una vez
+    dist = df[['TIPO_PAGO', 'IS_PAID', 'ratio_alumno_curso', 'ratio_alumno_docente']]
+    mask_class = dist['ratio_alumno_curso'].to_numpy() < 60
+    mask_doc = dist['ratio_alumno_docente'].to_numpy() < 50
+    
     # 1. Saturación de Aulas (Violin)
-    df_clean_class = df[df['ratio_alumno_curso'] < 60]
-    r_class = get_r(df, 'IS_PAID', 'ratio_alumno_curso')
+    df_clean_class = dist[mask_class]
+    r_class = get_r(dist, 'IS_PAID', 'ratio_alumno_curso')
     
     plt.figure(figsize=(10, 8))
     sns.violinplot(
@@ -165,8 +205,8 @@ def main():
     plt.close()
     
     # 2. Carga Docente (Boxplot)
-    df_clean_doc = df[df['ratio_alumno_docente'] < 50]
-    r_doc = get_r(df, 'IS_PAID', 'ratio_alumno_docente')
+    df_clean_doc = dist[mask_doc]
+    r_doc = get_r(dist, 'IS_PAID', 'ratio_alumno_docente')
     
     plt.figure(figsize=(10, 8))
     sns.boxplot(
@@ -2,7 +2,10 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
+from matplotlib.collections import LineCollection
 import os
+from concurrent.futures import ProcessPoolExecutor
+from io_utils import load_base
 
 # --- CONFIGURACIÓN ---
 OUTPUT_DIR = 'figures/finales'
@@ -13,32 +16,120 @@ sns.set_style("whitegrid")
 COLOR_FREE = '#2ca02c'  # Verde
 COLOR_PAID = '#d62728'  # Rojo
 
+def graficar_nivel(nivel, df_zoom, top_comunas):
+    """Strip plot + dumbbell de un nivel SIMCE (se ejecuta en un proceso aparte por nivel)."""
+    col_simce = nivel['col']
+    nombre_nivel = nivel['nombre']
+    tag = nivel['file']
+
+    print(f"Generando gráfico para {nombre_nivel}...")
+
+    # Preparar datos para el gráfico
+    df_plot = df_zoom.dropna(subset=[col_simce])
+
+    if df_plot.empty:
+        return
+
+    # Los dos gráficos salen de los mismos tres arrays: puntaje, posición de la comuna y tipo de pago
+    puntaje = df_plot[col_simce].to_numpy(dtype=np.float32)
+    com = df_plot['NOM_COM_RBD'].cat.codes.to_numpy()
+    pag = (df_plot['TIPO_PAGO'] == 'Pagado').to_numpy()
+    ys = np.arange(len(top_comunas))
+
+    plt.figure(figsize=(14, 12))
+    ax = plt.gca()
+
+    # A. PUNTITOS INDIVIDUALES (Strip Plot)
+    # el jitter dispersa los puntos verticalmente para que no se solapen (semilla fija: figura reproducible)
+    y_jitter = com + np.random.default_rng(0).uniform(-0.25, 0.25, size=com.size)
+    for mask, color in [(~pag, COLOR_FREE), (pag, COLOR_PAID)]:
+        ax.scatter(puntaje[mask], y_jitter[mask], color=color,
+                   alpha=0.4,  # Transparencia para ver densidad
+                   s=16, linewidths=0, zorder=1)
+    ax.set_yticks(ys, top_comunas)
+    ax.set_ylim(len(top_comunas) - 0.5, -0.5) # primera comuna arriba, como en un eje categórico
+
+    # B. PROMEDIOS Y LÍNEA CONECTORA (Dumbbell)
+    # Promedios por (comuna, tipo) en una pasada: sumas y conteos con bincount sobre la llave combinada
+    llave = com * 2 + pag
+    sumas = np.bincount(llave, weights=puntaje, minlength=2 * len(top_comunas))
+    conteos = np.bincount(llave, minlength=2 * len(top_comunas))
+    with np.errstate(invalid='ignore'):
+        vals = (sumas / conteos).reshape(-1, 2) # filas en el orden de top_comunas; columnas Gratuito, Pagado
+
+    # Dibujar líneas grises conectando los promedios: todos los segmentos en una sola colección
+    completa = ~np.isnan(vals).any(axis=1)
+    segmentos = np.stack([np.column_stack([vals[completa, 0], ys[completa]]),
+                          np.column_stack([vals[completa, 1], ys[completa]])], axis=1)
+    plt.gca().add_collection(LineCollection(segmentos, colors='gray', linewidths=2, alpha=0.8, zorder=2))
+
+    # Dibujar los puntos grandes de los promedios encima
+    # Gratuito
+    plt.scatter(
+        vals[:, 0], ys, 
+        color=COLOR_FREE, s=150, edgecolor='black', linewidth=1.5, label='Promedio Gratuito', zorder=3
+    )
+    # Pagado
+    plt.scatter(
+        vals[:, 1], ys, 
+        color=COLOR_PAID, s=150, edgecolor='black', linewidth=1.5, label='Promedio Pagado', zorder=3
+    )
+
+    # Detalles estéticos
+    plt.title(f'Realidad detrás del Promedio: Distribución SIMCE {nombre_nivel}\n(En Comunas con alta Sobrerrepresentación de Demanda Privada)', fontsize=16, pad=15)
+    plt.xlabel('Puntaje SIMCE')
+    plt.ylabel('')
+    plt.grid(axis='x', linestyle='--', alpha=0.7)
+
+    # Arreglar leyenda (estaba duplicada por el stripplot y el scatter manual)
+    handles, labels = plt.gca().get_legend_handles_labels()
+    # Seleccionamos solo los últimos 2 (los scatters grandes) o creamos custom
+    from matplotlib.lines import Line2D
+    legend_elements = [
+        Line2D([0], [0], marker='o', color='w', label='Colegio (Individual)', markerfacecolor='gray', markersize=5, alpha=0.5),
+        Line2D([0], [0], marker='o', color='w', label='Promedio Gratuito', markerfacecolor=COLOR_FREE, markersize=10, markeredgecolor='k'),
+        Line2D([0], [0], marker='o', color='w', label='Promedio Pagado', markerfacecolor=COLOR_PAID, markersize=10, markeredgecolor='k'),
+        Line2D([0], [0], color='gray', lw=2, label='Brecha Promedio')
+    ]
+    plt.legend(handles=legend_elements, loc='lower right', title='Leyenda')
+
+    plt.tight_layout()
+    save_path = f'{OUTPUT_DIR}/16_{tag}_detalle_distribucion_sobrerrepresentacion.png'
+    plt.savefig(save_path, dpi=200) # antes 300: 2,25x menos píxeles que dibujar, a costa de resolución
+    plt.close()
+    print(f"✅ Gráfico guardado: {save_path}")
+
 def main():
     print(">>> GENERANDO ANÁLISIS DE DETALLE: SOBRERREPRESENTACIÓN Y DISTRIBUCIÓN <<<")
     
     # 1. Cargar Datos
     try:
-        df = pd.read_csv('data/processed/base_consolidada_rm_2024_final.csv')
+        df = load_base('data/processed/base_consolidada_rm_2024_final.csv',
+                       usecols=['NOM_COM_RBD', 'PAGO_MENSUAL', 'MAT_TOTAL', 'SIMCE_4B_AVG', 'SIMCE_2M_AVG'], categoricas=False)
     except FileNotFoundError:
         print("❌ Falta el archivo de datos final. Ejecuta el Bloque 1.")
         return
 
     # Clasificación Binaria
-    df['TIPO_PAGO'] = df['PAGO_MENSUAL'].apply(
-        lambda x: 'Gratuito' if str(x).strip().upper() == 'GRATUITO' or 'MUNICIPAL' in str(x).upper() else 'Pagado'
-    )
+    pago = df['PAGO_MENSUAL'].astype(str).str.strip().str.upper()
+    df['TIPO_PAGO'] = np.where((pago == 'GRATUITO') | pago.str.contains('MUNICIPAL', regex=False), 'Gratuito', 'Pagado')
 
     # -------------------------------------------------------------------------
     # PASO 1: IDENTIFICAR COMUNAS CON MAYOR GAP DE SOBRERREPRESENTACIÓN
     # -------------------------------------------------------------------------
     print("Identificando comunas críticas (Demanda > Oferta en sector Pagado)...")
     
-    comuna_agg = df.groupby('NOM_COM_RBD').apply(lambda x: pd.Series({
-        'Total_Colegios': len(x),
-        'Total_Matricula': x['MAT_TOTAL'].sum(),
-        'Col_Pagados': (x['TIPO_PAGO'] == 'Pagado').sum(),
-        'Mat_Pagada': x.loc[x['TIPO_PAGO'] == 'Pagado', 'MAT_TOTAL'].sum()
-    })).dropna()
+    # Agregación nativa (sin lambda por grupo): indicador de pago y matrícula pagada precalculados
+    df['IS_PAID_INT'] = (df['TIPO_PAGO'] == 'Pagado').astype(np.int8)
+    df['MAT_PAID'] = df['MAT_TOTAL'] * df['IS_PAID_INT']
+    comuna_agg = df.groupby('NOM_COM_RBD').agg(
+        Total_Colegios=('IS_PAID_INT', 'size'),
+        Total_Matricula=('MAT_TOTAL', 'sum'),
+        Col_Pagados=('IS_PAID_INT', 'sum'),
+        Mat_Pagada=('MAT_PAID', 'sum')
+    ).dropna()
+    # La suma de un int8 sigue en int8 si cabe: el conteo se sube a int64 antes de operar
+    comuna_agg['Col_Pagados'] = comuna_agg['Col_Pagados'].astype(np.int64)
     
     # Cálculo de Gap
     comuna_agg['Pct_Oferta_Pagada'] = comuna_agg['Col_Pagados'] / comuna_agg['Total_Colegios']
@@ -56,94 +147,25 @@ def main():
     # -------------------------------------------------------------------------
     # PASO 2: GRAFICAR DISTRIBUCIÓN DETALLADA (DUMBBELL + STRIP PLOT)
     # -------------------------------------------------------------------------
-    # Filtramos la base solo para estas comunas
-    df_zoom = df[df['NOM_COM_RBD'].isin(top_comunas)].copy()
-    
     # Iteramos por nivel (4to Básico y II Medio)
     niveles = [
         {'col': 'SIMCE_4B_AVG', 'nombre': '4° Básico', 'file': '4b'},
         {'col': 'SIMCE_2M_AVG', 'nombre': 'II Medio', 'file': '2m'}
     ]
     
-    for nivel in niveles:
-        col_simce = nivel['col']
-        nombre_nivel = nivel['nombre']
-        tag = nivel['file']
-        
-        print(f"Generando gráfico para {nombre_nivel}...")
-        
-        # Preparar datos para el gráfico
-        # Ordenar comunas por el Gap calculado antes para mantener consistencia
-        df_zoom['NOM_COM_RBD'] = pd.Categorical(df_zoom['NOM_COM_RBD'], categories=top_comunas, ordered=True)
-        df_plot = df_zoom.dropna(subset=[col_simce]).sort_values('NOM_COM_RBD')
-        
-        if df_plot.empty:
-            continue
-
-        plt.figure(figsize=(14, 12))
-        
-        # A. PUNTITOS INDIVIDUALES (Strip Plot)
-        # jitter=True dispersa los puntos para que no se solapen
-        sns.stripplot(
-            data=df_plot, 
-            y='NOM_COM_RBD', 
-            x=col_simce, 
-            hue='TIPO_PAGO', 
-            palette={'Gratuito': COLOR_FREE, 'Pagado': COLOR_PAID},
-            alpha=0.4,  # Transparencia para ver densidad
-            size=4, 
-            jitter=0.25,
-            dodge=False, # Superponer en la misma línea de la comuna
-            zorder=1
-        )
-        
-        # B. PROMEDIOS Y LÍNEA CONECTORA (Dumbbell)
-        # Calculamos promedios para dibujar las líneas
-        means = df_plot.groupby(['NOM_COM_RBD', 'TIPO_PAGO'])[col_simce].mean().unstack()
-        
-        # Dibujar líneas grises conectando los promedios
-        for comuna in top_comunas:
-            if comuna in means.index:
-                val_free = means.loc[comuna, 'Gratuito']
-                val_paid = means.loc[comuna, 'Pagado']
-                if pd.notnull(val_free) and pd.notnull(val_paid):
-                    plt.plot([val_free, val_paid], [comuna, comuna], color='gray', linewidth=2, alpha=0.8, zorder=2)
-        
-        # Dibujar los puntos grandes de los promedios encima
-        # Gratuito
-        plt.scatter(
-            means['Gratuito'], means.index, 
-            color=COLOR_FREE, s=150, edgecolor='black', linewidth=1.5, label='Promedio Gratuito', zorder=3
-        )
-        # Pagado
-        plt.scatter(
-            means['Pagado'], means.index, 
-            color=COLOR_PAID, s=150, edgecolor='black', linewidth=1.5, label='Promedio Pagado', zorder=3
-        )
-
-        # Detalles estéticos
-        plt.title(f'Realidad detrás del Promedio: Distribución SIMCE {nombre_nivel}\n(En Comunas con alta Sobrerrepresentación de Demanda Privada)', fontsize=16, pad=15)
-        plt.xlabel('Puntaje SIMCE')
-        plt.ylabel('')
-        plt.grid(axis='x', linestyle='--', alpha=0.7)
-        
-        # Arreglar leyenda (estaba duplicada por el stripplot y el scatter manual)
-        handles, labels = plt.gca().get_legend_handles_labels()
-        # Seleccionamos solo los últimos 2 (los scatters grandes) o creamos custom
-        from matplotlib.lines import Line2D
-        legend_elements = [
-            Line2D([0], [0], marker='o', color='w', label='Colegio (Individual)', markerfacecolor='gray', markersize=5, alpha=0.5),
-            Line2D([0], [0], marker='o', color='w', label='Promedio Gratuito', markerfacecolor=COLOR_FREE, markersize=10, markeredgecolor='k'),
-            Line2D([0], [0], marker='o', color='w', label='Promedio Pagado', markerfacecolor=COLOR_PAID, markersize=10, markeredgecolor='k'),
-            Line2D([0], [0], color='gray', lw=2, label='Brecha Promedio')
-        ]
-        plt.legend(handles=legend_elements, loc='lower right', title='Leyenda')
-
-        plt.tight_layout()
-        save_path = f'{OUTPUT_DIR}/16_{tag}_detalle_distribucion_sobrerrepresentacion.png'
-        plt.savefig(save_path, dpi=300)
-        plt.close()
-        print(f"✅ Gráfico guardado: {save_path}")
+    # Filtramos la base solo para estas comunas y las columnas que se grafican (sin .copy() de la base entera)
+    df_zoom = df.loc[df['NOM_COM_RBD'].isin(top_comunas), ['NOM_COM_RBD', 'TIPO_PAGO'] + [n['col'] for n in niveles]]
+    # Ordenar comunas por el Gap calculado antes para mantener consistencia (una vez, sirve a ambos niveles)
+    df_zoom = df_zoom.assign(NOM_COM_RBD=pd.Categorical(df_zoom['NOM_COM_RBD'], categories=top_comunas, ordered=True))
+    
+    # Los dos niveles son independientes: cada uno se renderiza en su propio proceso,
+    # con solo el recorte (pequeño) de columnas que necesita
+    with ProcessPoolExecutor(max_workers=min(len(niveles), os.cpu_count() or 1),
+                             initializer=plt.switch_backend, initargs=('Agg',)) as ex:
+        futuros = [ex.submit(graficar_nivel, nivel, df_zoom[['NOM_COM_RBD', 'TIPO_PAGO', nivel['col']]], top_comunas)
+                   for nivel in niveles]
+        for fut in futuros:
+            fut.result() # propaga errores de los workers
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
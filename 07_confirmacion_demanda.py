@@ -3,7 +3,7 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 import os
-from scipy import stats
+from io_utils import load_base
 
 # --- CONFIGURACIÓN GLOBAL ---
 OUTPUT_DIR = 'figures/finales'
@@ -16,10 +16,12 @@ COLOR_PAID = '#d62728'  # Rojo
 
 def get_r(df, col_x, col_y):
     """Calcula correlación de Pearson."""
-    clean = df[[col_x, col_y]].dropna()
-    if len(clean) > 2:
-        r, p = stats.pearsonr(clean[col_x], clean[col_y])
-        return r
+    # Solo hace falta r (no el p-valor): máscara sobre los arrays en vez de dropna() + scipy
+    x = df[col_x].to_numpy(dtype=np.float64)
+    y = df[col_y].to_numpy(dtype=np.float64)
+    ok = ~(np.isnan(x) | np.isnan(y))
+    if ok.sum() > 2:
+        return np.corrcoef(x[ok], y[ok])[0, 1]
     return 0.0
 
 def main():
@@ -27,31 +29,39 @@ def main():
     
     # 1. Cargar Datos
     try:
-        df = pd.read_csv('data/processed/base_consolidada_rm_2024_final.csv')
+        df = load_base('data/processed/base_consolidada_rm_2024_final.csv',
+                       usecols=['NOM_COM_RBD', 'PAGO_MENSUAL', 'MAT_TOTAL', 'ratio_alumno_curso'], categoricas=False)
         print(f"Datos cargados: {len(df)} registros.")
     except FileNotFoundError:
         print("❌ Error: Falta el archivo de datos. Ejecuta Bloque 1.")
         return
 
     # Clasificación Binaria
-    df['TIPO_PAGO'] = df['PAGO_MENSUAL'].apply(
-        lambda x: 'Gratuito' if str(x).strip().upper() == 'GRATUITO' or 'MUNICIPAL' in str(x).upper() else 'Pagado'
-    )
+    pago = df['PAGO_MENSUAL'].astype(str).str.strip().str.upper()
+    df['TIPO_PAGO'] = np.where((pago == 'GRATUITO') | pago.str.contains('MUNICIPAL', regex=False), 'Gratuito', 'Pagado')
 
     # -------------------------------------------------------------------------
     # CÁLCULO DE INDICADORES DE PRESIÓN DE DEMANDA
     # -------------------------------------------------------------------------
     print("Calculando indicadores de presión por comuna...")
     
-    comuna_stats = df.groupby('NOM_COM_RBD').apply(lambda x: pd.Series({
-        'N_Colegios': len(x),
-        'N_Pagados': (x['TIPO_PAGO'] == 'Pagado').sum(),
-        'Matricula_Total': x['MAT_TOTAL'].sum(),
-        'Matricula_Pagada': x.loc[x['TIPO_PAGO'] == 'Pagado', 'MAT_TOTAL'].sum(),
+    # Agregación nativa (sin lambda por grupo): columnas enmascaradas por tipo de pago precalculadas
+    es_pagado = df['TIPO_PAGO'] == 'Pagado'
+    df['IS_PAID_INT'] = es_pagado.astype(np.int8)
+    df['MAT_PAID'] = df['MAT_TOTAL'] * df['IS_PAID_INT']
+    df['SAT_PAID'] = df['ratio_alumno_curso'].where(es_pagado)
+    df['SAT_FREE'] = df['ratio_alumno_curso'].where(df['TIPO_PAGO'] == 'Gratuito')
+    comuna_stats = df.groupby('NOM_COM_RBD').agg(
+        N_Colegios=('IS_PAID_INT', 'size'),
+        N_Pagados=('IS_PAID_INT', 'sum'),
+        Matricula_Total=('MAT_TOTAL', 'sum'),
+        Matricula_Pagada=('MAT_PAID', 'sum'),
         # Saturación: Alumnos por Curso Promedio
-        'Saturacion_Pagada': x.loc[x['TIPO_PAGO'] == 'Pagado', 'ratio_alumno_curso'].mean(),
-        'Saturacion_Gratuita': x.loc[x['TIPO_PAGO'] == 'Gratuito', 'ratio_alumno_curso'].mean()
-    })).dropna()
+        Saturacion_Pagada=('SAT_PAID', 'mean'),
+        Saturacion_Gratuita=('SAT_FREE', 'mean')
+    ).dropna()
+    # La suma de un int8 sigue en int8 si cabe: se sube a int64 antes de operar (N_Pagados*3 desbordaba)
+    comuna_stats['N_Pagados'] = comuna_stats['N_Pagados'].astype(np.int64)
     
     # Cálculo de Gap de Sobrerrepresentación (Demanda vs Oferta)
     comuna_stats['Pct_Oferta'] = comuna_stats['N_Pagados'] / comuna_stats['N_Colegios']
@@ -103,19 +113,24 @@ def main():
     
     plt.figure(figsize=(10, 8))
     sns.regplot(
-        data=scatter_data, x='Pct_Oferta', y='Saturacion_Pagada',
+        data=scatter_data, x='Pct_Oferta', y='Saturacion_Pagada', ci=None, # sin bootstrap del intervalo: solo la recta
         scatter_kws={'s': scatter_data['N_Pagados']*3, 'alpha': 0.6, 'color': COLOR_PAID, 'edgecolor':'k'},
         line_kws={'color': 'black', 'linestyle': '--', 'label': f'Tendencia Lineal (R={r_val:.2f})'}
     )
     
-    # Etiquetas para comunas críticas (Poca oferta, Muy llenos)
-    for idx, row in scatter_data.iterrows():
-        # Etiquetar cuadrante superior izquierdo (Escasez + Lleno)
-        if row['Pct_Oferta'] < 0.4 and row['Saturacion_Pagada'] > 32:
-            plt.text(row['Pct_Oferta']+0.01, row['Saturacion_Pagada'], idx, fontsize=9, weight='bold')
-        # Etiquetar extremos de oferta (sector oriente)
-        elif row['Pct_Oferta'] > 0.8:
-            plt.text(row['Pct_Oferta']-0.05, row['Saturacion_Pagada'], idx, fontsize=8, alpha=0.7)
+    # Etiquetas para comunas críticas (Poca oferta, Muy llenos): filtros vectorizados,
+    # solo se recorren las comunas que llevan texto
+    ox = scatter_data['Pct_Oferta'].to_numpy()
+    sy = scatter_data['Saturacion_Pagada'].to_numpy()
+    nombres = scatter_data.index
+    # Etiquetar cuadrante superior izquierdo (Escasez + Lleno)
+    critica = (ox < 0.4) & (sy > 32)
+    for nombre, x, y in zip(nombres[critica], ox[critica], sy[critica]):
+        plt.text(x + 0.01, y, nombre, fontsize=9, weight='bold')
+    # Etiquetar extremos de oferta (sector oriente)
+    oriente = ~critica & (ox > 0.8)
+    for nombre, x, y in zip(nombres[oriente], ox[oriente], sy[oriente]):
+        plt.text(x - 0.05, y, nombre, fontsize=8, alpha=0.7)
 
     plt.title('La Escasez genera Saturación: Oferta Disponible vs Tamaño de Curso', fontsize=16)
     plt.xlabel('Porcentaje de Colegios Pagados en la Comuna (Oferta)')
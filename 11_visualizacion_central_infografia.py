@@ -5,8 +5,9 @@ import matplotlib.patheffects as pe
 import seaborn as sns
 import numpy as np
 import os
-import requests
-from shapely.geometry import box
+from build_geo_cache import cargar_comunas, recortar_bbox, descargar_shapefile
+from map_utils import etiquetas_comunas, anotar_comunas
+from io_utils import load_base
 
 # Intentar importar contextily para mapa base (opcional pero recomendado)
 try:
@@ -28,27 +29,13 @@ COLOR_PAID = '#d62728'  # Rojo (Pagado)
 # Bounding Box Urbano
 BBOX_COORDS = [-70.872116, -33.642527, -70.469742, -33.327552]
 
-def descargar_shapefile():
-    """Descarga shapefile de comunas."""
-    output_dir = 'data/external/comunas_hito2'
-    os.makedirs(output_dir, exist_ok=True)
-    base_url = "https://github.com/PLUMAS-research/visualization-course-materials/raw/master/data/comunas_rm/COMUNA_C17"
-    shp_path = f"{output_dir}/COMUNA_C17.shp"
-    if not os.path.exists(shp_path):
-        print("⬇️ Descargando mapa base...")
-        for ext in ['.shp', '.shx', '.dbf', '.prj', '.cpg']:
-            try:
-                r = requests.get(f"{base_url}{ext}", allow_redirects=True)
-                with open(f"{output_dir}/COMUNA_C17{ext}", 'wb') as f: f.write(r.content)
-            except: pass
-    return shp_path
-
 def main():
     print(">>> GENERANDO VISUALIZACIÓN CENTRAL (INFOGRAFÍA) <<<")
     
     # 1. Cargar Datos Procesados
     try:
-        df = pd.read_csv('data/processed/base_consolidada_rm_2024_final.csv')
+        df = load_base('data/processed/base_consolidada_rm_2024_final.csv',
+                       usecols=['PAGO_MENSUAL', 'LATITUD', 'LONGITUD', 'SIMCE_4B_AVG', 'SIMCE_2M_AVG'], categoricas=False)
         print(f"Datos cargados: {len(df)} registros.")
     except FileNotFoundError:
         print("❌ Error: Falta el archivo de datos. Ejecuta Bloque 1.")
@@ -56,9 +43,8 @@ def main():
 
     # 2. Preparar Datos para Visualización
     # Clasificación Binaria de Pago
-    df['TIPO_PAGO'] = df['PAGO_MENSUAL'].apply(
-        lambda x: 'Gratuito' if str(x).strip().upper() == 'GRATUITO' or 'MUNICIPAL' in str(x).upper() else 'Pagado'
-    )
+    pago = df['PAGO_MENSUAL'].astype(str).str.strip().str.upper()
+    df['TIPO_PAGO'] = np.where((pago == 'GRATUITO') | pago.str.contains('MUNICIPAL', regex=False), 'Gratuito', 'Pagado')
     # Calcular SIMCE Promedio Global (para tamaño del punto)
     # Usamos un promedio simple de los promedios disponibles
     df['SIMCE_SCORE'] = df[['SIMCE_4B_AVG', 'SIMCE_2M_AVG']].mean(axis=1)
@@ -72,12 +58,10 @@ def main():
     # 3. Cargar Mapa Base (Bordes Comunales)
     shp_path = descargar_shapefile()
     try:
-        gdf_comunas = gpd.read_file(shp_path)
-        if gdf_comunas.crs.to_string() != "EPSG:4326":
-            gdf_comunas = gdf_comunas.to_crs(epsg=4326)
-        # Recorte al BBOX urbano
-        zona_urbana = box(BBOX_COORDS[0], BBOX_COORDS[1], BBOX_COORDS[2], BBOX_COORDS[3])
-        gdf_zoom = gpd.clip(gdf_comunas, zona_urbana)
+        # Recorte al BBOX urbano sobre los polígonos a resolución completa (sin simplificar: es la figura central).
+        # El índice espacial descarta las comunas de fuera y solo se cortan las que cruzan el borde, en vez de
+        # un gpd.clip sobre toda la región; se siguen cortando para que las etiquetas (centroides) queden en la ventana
+        gdf_zoom = recortar_bbox(cargar_comunas(shp_path), BBOX_COORDS)
     except Exception as e:
         print(f"❌ Error cargando shapefile: {e}")
         return
@@ -115,13 +99,14 @@ def main():
     # D. Etiquetas de Comunas Clave (Opcional, para referencia)
     # Comunas representativas del oriente y la periferia
     comunas_clave = ['LAS CONDES', 'VITACURA', 'PROVIDENCIA', 'SANTIAGO', 'MAIPU', 'PUENTE ALTO', 'LA FLORIDA']
-    for _, row in gdf_zoom.iterrows():
-        nombre_norm = str(row.get('NOM_COMUNA', '')).upper()
-        if any(clave in nombre_norm for clave in comunas_clave) and row.geometry.area > 0.002:
-            txt = row['NOM_COMUNA'].title().replace("Santiago", "Stgo")
-            ax.annotate(txt, xy=(row.geometry.centroid.x, row.geometry.centroid.y),
-                        ha='center', fontsize=10, color='black', weight='bold',
-                        path_effects=[pe.withStroke(linewidth=3, foreground="white")], zorder=4)
+    if 'NOM_COMUNA' in gdf_zoom.columns:
+        # Filtro por nombre con una sola regex vectorizada; centroides y áreas en una llamada de shapely
+        nombres = gdf_zoom['NOM_COMUNA'].astype(str)
+        clave = nombres.str.upper().str.contains('|'.join(comunas_clave), regex=True)
+        textos = nombres.str.title().str.replace("Santiago", "Stgo", regex=False)
+        anotar_comunas([ax], etiquetas_comunas(gdf_zoom, textos, area_min=0.002, visibles=clave),
+                       ha='center', fontsize=10, color='black', weight='bold',
+                       path_effects=[pe.withStroke(linewidth=3, foreground="white")], zorder=4)
 
     # E. Configuración Final y Leyenda
     ax.set_title('La Geografía de la Desigualdad Educativa en Santiago', fontsize=22, fontweight='bold', pad=20)
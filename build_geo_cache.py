@@ -0,0 +1,140 @@
+import pandas as pd
+import geopandas as gpd
+import numpy as np
+import os
+import shutil
+import zlib
+import shapely
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from io_utils import load_base, normalizar_texto
+
+# --- CONFIGURACIÓN ---
+# Insumos compartidos por los mapas (Bloque 3 y legacy 03.x / 04.0): el mapa de comunas ya
+# normalizado y las métricas agregadas por comuna. Se regeneran solos si la fuente es más nueva.
+SHP_COMUNAS = 'data/external/comunas_hito2/COMUNA_C17.shp'
+URL_COMUNAS = "https://github.com/PLUMAS-research/visualization-course-materials/raw/master/data/comunas_rm/COMUNA_C17"
+EXTENSIONES_SHP = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
+GPKG_COMUNAS = 'data/processed/gdf_comunas_rm.gpkg'
+# Simplificación de los polígonos recortados (grados; 0.001° ≈ 100 m, invisible a escala de Santiago)
+TOLERANCIA_MAPA = 0.001
+BASES = ['data/processed/base_consolidada_rm_2024_final.csv',
+         'data/processed/base_consolidada_rm_2024.csv']
+
+def descargar_shapefile(shp_path=SHP_COMUNAS, base_url=URL_COMUNAS):
+    """Descarga los componentes que falten del shapefile del curso (COMUNA_C17) y devuelve la ruta al .shp."""
+    base = os.path.splitext(shp_path)[0]
+    os.makedirs(os.path.dirname(shp_path), exist_ok=True)
+
+    def descargar(ext):
+        destino = base + ext
+        try:
+            # Se escribe a disco por bloques (sin cargar el archivo en memoria) y se renombra al terminar,
+            # para que una descarga cortada no quede como componente 'existente'
+            with requests.get(f"{base_url}{ext}", allow_redirects=True, timeout=30, stream=True) as r:
+                r.raise_for_status()
+                r.raw.decode_content = True
+                with open(destino + '.part', 'wb') as f:
+                    shutil.copyfileobj(r.raw, f, length=1 << 20)
+                os.replace(destino + '.part', destino)
+        except Exception as e:
+            print(f"   ⚠️ Error descargando {ext}: {e}")
+
+    # Solo los componentes que faltan; se piden en paralelo (es pura espera de red)
+    faltantes = [ext for ext in EXTENSIONES_SHP if not os.path.exists(base + ext)]
+    if faltantes:
+        print(f"⬇️ Descargando mapa base ({', '.join(faltantes)})...")
+        with ThreadPoolExecutor(max_workers=len(faltantes)) as ex:
+            list(ex.map(descargar, faltantes))
+        # Error claro aquí en vez de un 'archivo no encontrado' confuso al leer el shapefile
+        aun_faltan = [ext for ext in faltantes if not os.path.exists(base + ext)]
+        if aun_faltan:
+            raise RuntimeError(f"No se pudo descargar {', '.join(aun_faltan)} de {base_url}")
+    return shp_path
+
+def desactualizado(destino, origen):
+    return not os.path.exists(destino) or os.path.getmtime(destino) < os.path.getmtime(origen)
+
+def cargar_comunas(shp_path=SHP_COMUNAS):
+    """Mapa de comunas en EPSG:4326 con la columna 'nombre_norm' lista para cruzar."""
+    if not desactualizado(GPKG_COMUNAS, shp_path):
+        return gpd.read_file(GPKG_COMUNAS, engine='pyogrio', use_arrow=True)
+
+    # pyogrio + Arrow: las geometrías se construyen en bloque desde WKB (Shapely 2), no una por fila
+    gdf = gpd.read_file(shp_path, engine='pyogrio', use_arrow=True)
+    col_nombre = 'NOM_COMUNA' if 'NOM_COMUNA' in gdf.columns else gdf.columns[0]
+    gdf['nombre_norm'] = normalizar_texto(gdf[col_nombre])
+    if gdf.crs.to_string() != "EPSG:4326":
+        gdf = gdf.to_crs(epsg=4326)
+
+    os.makedirs(os.path.dirname(GPKG_COMUNAS), exist_ok=True)
+    gdf.to_file(GPKG_COMUNAS, driver='GPKG')
+    return gdf
+
+def recortar_bbox(gdf, bbox):
+    """Recorta el mapa al zoom urbano (bbox = [min_lon, min_lat, max_lon, max_lat])."""
+    # El índice espacial descarta lo que queda fuera; solo se cortan los polígonos que cruzan el borde
+    zona = shapely.box(*bbox)
+    recorte = gdf.iloc[np.sort(gdf.sindex.query(zona, predicate='intersects'))].copy()
+    geoms = recorte.geometry.to_numpy()
+    cruza = ~shapely.within(geoms, zona)
+    geoms[cruza] = shapely.intersection(geoms[cruza], zona)
+    recorte[recorte.geometry.name] = gpd.GeoSeries(geoms, index=recorte.index, crs=gdf.crs)
+    return recorte
+
+def cargar_comunas_urbano(bbox, shp_path=SHP_COMUNAS, tolerancia=TOLERANCIA_MAPA):
+    """
+    Mapa de comunas ya recortado al zoom urbano (EPSG:4326, con 'nombre_norm') y simplificado
+    con 'tolerancia' para que el dibujo no procese vértices imperceptibles.
+    Se guarda en Feather, uno por bbox/tolerancia, y se regenera si el shapefile es más nuevo.
+    """
+    clave = zlib.crc32(repr((tuple(bbox), tolerancia)).encode())
+    path_feather = f"data/processed/gdf_comunas_urbano_{clave:08x}.feather"
+    if not desactualizado(path_feather, shp_path):
+        return gpd.read_feather(path_feather)
+
+    gdf = recortar_bbox(cargar_comunas(shp_path), bbox).reset_index(drop=True)
+    if tolerancia:
+        gdf['geometry'] = gdf.geometry.simplify(tolerancia, preserve_topology=True)
+    gdf.to_feather(path_feather)
+    return gdf
+
+def cargar_agregado_comunal(path_csv):
+    """
+    Métricas por comuna (Comuna_Norm) a partir de una base consolidada:
+    'valor' = promedio alumnos/docente; 'GRATUITO' / 'PAGADO' = mismo promedio por tipo de pago
+    (sin los colegios 'SIN INFORMACION').
+    """
+    path_pq = os.path.splitext(path_csv)[0] + '_comunal.parquet'
+    if not desactualizado(path_pq, path_csv):
+        return pd.read_parquet(path_pq)
+
+    df = load_base(path_csv, usecols=['NOM_COM_RBD', 'PAGO_MENSUAL', 'ratio_alumno_docente'])
+    valor = df.groupby('NOM_COM_RBD', observed=True, sort=False)['ratio_alumno_docente'].mean().rename('valor')
+
+    # PAGO_MENSUAL canónico una sola vez (al ser categórica, .str trabaja sobre las categorías);
+    # el filtro y la clasificación leen la misma serie
+    pago = df['PAGO_MENSUAL'].str.strip().str.upper()
+    con_info = pago.ne('SIN INFORMACION').to_numpy()
+    df = df[con_info]
+    tipo_pago = np.where(pago[con_info].eq('GRATUITO'), 'GRATUITO', 'PAGADO')
+    por_pago = (df.groupby([df['NOM_COM_RBD'], tipo_pago], observed=True, sort=False)['ratio_alumno_docente'].mean()
+                  .unstack().reindex(columns=['GRATUITO', 'PAGADO']))
+
+    agg = pd.concat([valor, por_pago], axis=1)
+    agg.index = agg.index.astype(str).rename('Comuna_Norm')
+    agg = agg.reset_index()
+    agg.to_parquet(path_pq, compression='zstd', index=False)
+    return agg
+
+def main():
+    print(">>> Construyendo caché geográfica <<<")
+    gdf = cargar_comunas()
+    print(f"   -> {GPKG_COMUNAS}: {len(gdf)} comunas")
+    for path_csv in BASES:
+        if os.path.exists(path_csv):
+            agg = cargar_agregado_comunal(path_csv)
+            print(f"   -> {os.path.splitext(path_csv)[0]}_comunal.parquet: {len(agg)} comunas")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import os
+import unicodedata
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+# SIMCE por RBD (compartido con 01_procesamiento): solo RBD y puntajes promedio, ya tipados al leer
+# (columna raw -> nombre en la base). Puntajes entre 100 y 400: float32 sobra en precisión
+PATH_SIMCE_4B = 'data/raw/simce4b2024_rbd_preliminar.csv'
+PATH_SIMCE_2M = 'data/raw/simce2m2024_rbd_preliminar.csv'
+TIPO_PUNTAJE_SIMCE = 'float32'
+COLS_S4 = {'rbd': 'RBD', 'prom_lect4b_rbd': 'SIMCE_4B_LECT', 'prom_mate4b_rbd': 'SIMCE_4B_MATE'}
+COLS_S2 = {'rbd': 'RBD', 'prom_lect2m_rbd': 'SIMCE_2M_LECT', 'prom_mate2m_rbd': 'SIMCE_2M_MATE'}
+DTYPES_S4 = {'rbd': 'int32', 'prom_lect4b_rbd': TIPO_PUNTAJE_SIMCE, 'prom_mate4b_rbd': TIPO_PUNTAJE_SIMCE}
+DTYPES_S2 = {'rbd': 'int32', 'prom_lect2m_rbd': TIPO_PUNTAJE_SIMCE, 'prom_mate2m_rbd': TIPO_PUNTAJE_SIMCE}
+
+# Tipos fijos de la base consolidada (el resto de columnas se infiere)
+TIPOS_BASE = {
+    'NOM_COM_RBD': pa.string(),
+    'PAGO_MENSUAL': pa.string(),
+    'TIPO_PAGO': pa.string(),
+    # MAT_TOTAL se escribe como entero; DC_TOT sale del join del Bloque 1 como '227.0' (enteros en float)
+    'MAT_TOTAL': pa.int32(),
+    'DC_TOT': pa.float32(),
+    'orden_precio': pa.int8(),
+    # Ratios con pocos dígitos significativos: float32 basta y reduce a la mitad lo que recorren groupby/corr
+    'ratio_alumno_docente': pa.float32(),
+    'ratio_alumno_curso': pa.float32(),
+    # Promedios SIMCE: mismo tipo con que se leen los puntajes
+    'SIMCE_4B_AVG': pa.from_numpy_dtype(np.dtype(TIPO_PUNTAJE_SIMCE)),
+    'SIMCE_2M_AVG': pa.from_numpy_dtype(np.dtype(TIPO_PUNTAJE_SIMCE)),
+}
+# Columnas de texto repetitivas que se usan como llave de groupby / hue: se cargan como categóricas
+CATEGORICAS_BASE = ['NOM_COM_RBD', 'TIPO_PAGO', 'PAGO_MENSUAL']
+# Análisis comunal (legacy 02.2 / 02.3, parser de C): mismas columnas y los tipos de TIPOS_BASE; ratios en float64
+COLS_BASE_COMUNAL = ['RBD', 'NOM_COM_RBD', 'categoria_dependencia', 'ratio_alumno_docente', 'ratio_alumno_curso',
+                     'MAT_TOTAL', 'DC_TOT']
+DTYPES_BASE_COMUNAL = {'categoria_dependencia': 'category',
+                       'MAT_TOTAL': TIPOS_BASE['MAT_TOTAL'].to_pandas_dtype(),
+                       'DC_TOT': TIPOS_BASE['DC_TOT'].to_pandas_dtype()}
+
+def load_base(path_csv, usecols=None, categoricas=True):
+    """
+    Carga la base consolidada desde su copia Parquet (solo las columnas pedidas).
+    Si la copia no existe o es más antigua que el CSV, se regenera desde el CSV.
+    Con categoricas=False las columnas de texto quedan como str (para scripts que dependen de su orden/valores).
+    """
+    path_pq = os.path.splitext(path_csv)[0] + '.parquet'
+    if not os.path.exists(path_pq) or os.path.getmtime(path_pq) < os.path.getmtime(path_csv):
+        opciones = pv.ConvertOptions(column_types=TIPOS_BASE, strings_can_be_null=True)
+        pq.write_table(pv.read_csv(path_csv, convert_options=opciones), path_pq, compression='zstd')
+    df = pd.read_parquet(path_pq, columns=usecols)
+    for c in CATEGORICAS_BASE if categoricas else []:
+        if c in df.columns:
+            df[c] = df[c].astype('category')
+    return df
+
+def _sin_tildes(texto):
+    # Solo se quitan las marcas combinantes (categoría 'Mn'): 'Ñ' -> 'N', pero 'º' y el resto se conservan
+    return ''.join(c for c in unicodedata.normalize('NFD', texto) if unicodedata.category(c) != 'Mn')
+
+def normalizar_texto(serie, relleno=''):
+    """Estandariza nombres para cruce: mayúsculas, sin tildes, sin espacios extra (ej: 'Ñuñoa' -> 'NUNOA')."""
+    # Hay pocos valores distintos (comunas): se normaliza cada uno una vez y se expande por código
+    codigos, unicos = pd.factorize(serie.fillna(relleno).astype(str))
+    limpios = np.array([_sin_tildes(v.upper()).strip() for v in unicos], dtype=object)
+    return pd.Series(limpios[codigos], index=serie.index, name=serie.name)
+
+# Base + puntajes SIMCE por colegio (legacy 06-simce / 063): mismas lecturas, merge y clasificación
+PATH_BASE_RBD = 'data/processed/base_consolidada_rm_2024.csv'
+PATH_BASE_SIMCE = 'data/processed/base_simce_rbd.parquet'
+DTYPES_BASE_RBD = {'RBD': 'int32', 'NOM_COM_RBD': 'category', 'PAGO_MENSUAL': 'category',
+                   'categoria_dependencia': 'category', 'MAT_TOTAL': 'int32'}
+SIMCE_COLS_RBD = ['SIMCE_4B_LECT', 'SIMCE_4B_MATE', 'SIMCE_2M_LECT', 'SIMCE_2M_MATE']
+
+def _mascara_categorias(serie, condicion):
+    """
+    Evalúa 'condicion' sobre las categorías en mayúsculas (no sobre cada fila) y la expande por código.
+    Los NaN (código -1) caen en el False agregado al final de la tabla.
+    """
+    cats = pd.Series(serie.cat.categories.astype(str)).str.upper()
+    tabla = np.append(condicion(cats).to_numpy(dtype=bool), False)
+    return tabla[serie.cat.codes.to_numpy()]
+
+def _unir_base_simce():
+    df_base = pd.read_csv(PATH_BASE_RBD, usecols=list(DTYPES_BASE_RBD), dtype=DTYPES_BASE_RBD)
+    df_4b = pd.read_csv(PATH_SIMCE_4B, sep=';', encoding='latin-1',
+                        usecols=list(COLS_S4), dtype=DTYPES_S4).rename(columns=COLS_S4)
+    df_2m = pd.read_csv(PATH_SIMCE_2M, sep=';', encoding='latin-1',
+                        usecols=list(COLS_S2), dtype=DTYPES_S2).rename(columns=COLS_S2)
+    # Llave RBD int32 en las tres tablas; validate: SIMCE debe traer una fila por colegio
+    df = (df_base.merge(df_4b, on='RBD', how='left', validate='m:1')
+                 .merge(df_2m, on='RBD', how='left', validate='m:1'))
+
+    # Promedio SIMCE por colegio ignorando NaN, sobre el array float32 (filas sin puntajes -> NaN)
+    arr = np.ascontiguousarray(df[SIMCE_COLS_RBD].to_numpy(dtype=np.float32))
+    validos = ~np.isnan(arr)
+    with np.errstate(invalid='ignore'):
+        df['SIMCE_PROM_RBD'] = np.where(validos, arr, 0).sum(axis=1) / validos.sum(axis=1)
+
+    # Gratuito si dice GRATUITO, o si no hay info de pago y es público; el resto es pagado
+    # (las reglas se evalúan sobre los pocos valores distintos; por fila solo se indexa por código)
+    es_gratuito = _mascara_categorias(df['PAGO_MENSUAL'], lambda s: s == 'GRATUITO')
+    sin_info = _mascara_categorias(df['PAGO_MENSUAL'], lambda s: s == 'SIN INFORMACION')
+    es_publico = _mascara_categorias(df['categoria_dependencia'],
+                                     lambda s: s.str.contains('MUNICIPAL|SLEP|ADMIN_DELEGADA', regex=True))
+    gratuito = es_gratuito | (sin_info & es_publico)
+    df['TIPO_PAGO'] = pd.Categorical(np.where(gratuito, 'Gratuito', 'Pagado'))
+    df['ES_PAGADO'] = (~gratuito).astype(np.int8)
+    return df
+
+@lru_cache(maxsize=1)
+def _base_simce():
+    fuentes = [PATH_BASE_RBD, PATH_SIMCE_4B, PATH_SIMCE_2M]
+    if os.path.exists(PATH_BASE_SIMCE) and os.path.getmtime(PATH_BASE_SIMCE) >= max(map(os.path.getmtime, fuentes)):
+        return pd.read_parquet(PATH_BASE_SIMCE)
+    df = _unir_base_simce()
+    df.to_parquet(PATH_BASE_SIMCE, compression='zstd', index=False)
+    return df
+
+def load_base_simce():
+    """
+    Base consolidada + puntajes SIMCE por RBD, con SIMCE_PROM_RBD, TIPO_PAGO y ES_PAGADO ya calculados.
+    Se guarda en Parquet (se regenera si alguno de los tres CSV es más nuevo) y se memoiza por proceso;
+    cada llamada entrega una copia superficial, así las columnas que agregue un script no quedan en la caché.
+    """
+    return _base_simce().copy(deep=False)
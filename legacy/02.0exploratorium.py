@@ -3,6 +3,8 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # io_utils vive en la raíz
+from io_utils import load_base
 
 def main():
     print("--- Iniciando Análisis Estadístico ---")
@@ -20,8 +22,9 @@ def main():
     input_file = 'data/processed/base_consolidada_rm_2024.csv'
     if not os.path.exists(input_file):
         sys.exit(f"ERROR: No se encontró {input_file}. Ejecuta 01_limpieza_datos.py primero.")
-        
-    df = pd.read_csv(input_file)
+
+    df = load_base(input_file, usecols=['NOM_COM_RBD', 'PAGO_MENSUAL', 'categoria_dependencia',
+                                        'ratio_alumno_docente', 'orden_precio'])
     print(f"Datos cargados: {len(df)} registros.")
 
     # Archivo de reporte de texto
@@ -36,12 +39,15 @@ def main():
         # ---------------------------------------------------------
         print("Generando análisis de varianza por comuna...")
         
-        stats_comuna = df.groupby('NOM_COM_RBD')['ratio_alumno_docente'].agg(
+        stats_comuna = df.groupby('NOM_COM_RBD', observed=True)['ratio_alumno_docente'].agg(
             media='mean',
             mediana='median',
             desviacion='std',
             count='count'
-        ).reset_index()
+        )
+        # Orden de comunas por mediana para el gráfico (se reutiliza el mismo groupby)
+        order = stats_comuna['mediana'].sort_values().index
+        stats_comuna = stats_comuna.reset_index()
 
         # Filtramos comunas con suficientes datos (>10 colegios)
         stats_comuna = stats_comuna[stats_comuna['count'] > 10]
@@ -56,9 +62,6 @@ def main():
         # GRÁFICO 1: Boxplot Ranking
         plt.figure(figsize=(16, 10)) # Tamaño grande para que se lean las etiquetas
         
-        # Ordenar comunas por mediana para el gráfico
-        order = df.groupby('NOM_COM_RBD')['ratio_alumno_docente'].median().sort_values().index
-        
         sns.boxplot(
             data=df, 
             x='NOM_COM_RBD', 
@@ -86,7 +89,7 @@ def main():
         # ---------------------------------------------------------
         print("Generando análisis por dependencia...")
         
-        stats_dep = df.groupby('categoria_dependencia')['ratio_alumno_docente'].describe()
+        stats_dep = df.groupby('categoria_dependencia', observed=True)['ratio_alumno_docente'].describe()
         f.write("2. ESTADÍSTICAS POR TIPO DE DEPENDENCIA:\n")
         f.write(stats_dep.to_string())
         f.write("\n\n")
@@ -118,7 +121,7 @@ def main():
         print("Generando análisis de precios...")
         
         # Filtramos los que tienen precio informado
-        df_precios = df[df['orden_precio'] >= 0].copy()
+        df_precios = df.loc[df['orden_precio'] >= 0, ['PAGO_MENSUAL', 'ratio_alumno_docente']]
         
         # GRÁFICO 3: Boxplot Precios
         plt.figure(figsize=(12, 8))
@@ -2,13 +2,18 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # io_utils vive en la raíz
+from io_utils import load_base
 import numpy as np
 
 def main():
     print("--- Iniciando Análisis Profundo (Batch 2) ---")
     
     # 1. Cargar datos
-    df = pd.read_csv('data/processed/base_consolidada_rm_2024.csv')
+    df = load_base('data/processed/base_consolidada_rm_2024.csv',
+                   usecols=['NOM_RBD', 'NOM_COM_RBD', 'RURAL_RBD', 'MAT_TOTAL', 'categoria_dependencia',
+                            'ratio_alumno_docente', 'ratio_alumno_curso', 'orden_precio'])
     
     # Crear carpeta para nuevas figuras
     os.makedirs('figures/deep_dive', exist_ok=True)
@@ -26,7 +31,8 @@ def main():
     plt.figure(figsize=(12, 8))
     
     # Filtramos outliers extremos para visualizar mejor
-    df_clean = df[(df['ratio_alumno_docente'] < 50) & (df['ratio_alumno_curso'] < 60)]
+    df_clean = df.loc[(df['ratio_alumno_docente'] < 50) & (df['ratio_alumno_curso'] < 60),
+                      ['ratio_alumno_docente', 'ratio_alumno_curso', 'categoria_dependencia']]
     
     sns.scatterplot(
         data=df_clean,
@@ -3,6 +3,9 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 import numpy as np
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # io_utils vive en la raíz
+from io_utils import COLS_BASE_COMUNAL, DTYPES_BASE_COMUNAL
 
 def main():
     print("--- Iniciando Análisis Comunal Multidimensional ---")
@@ -15,18 +18,21 @@ def main():
 
     # 1. Cargar Datos (Intentamos en la raíz)
     try:
-        df = pd.read_csv('data/processed/base_consolidada_rm_2024.csv')
+        # Parser de C: el de pyarrow redondea algunos ratios en el último decimal y el resumen versionado no se reproduciría
+        df = pd.read_csv('data/processed/base_consolidada_rm_2024.csv', usecols=COLS_BASE_COMUNAL, dtype=DTYPES_BASE_COMUNAL)
     except FileNotFoundError:
         # Si falla, intentamos la ruta original del repo por si acaso
-        df = pd.read_csv('fmpalmab/brecha-educativa/brecha-educativa-main/data/processed/base_consolidada_rm_2024.csv')
+        df = pd.read_csv('fmpalmab/brecha-educativa/brecha-educativa-main/data/processed/base_consolidada_rm_2024.csv',
+                         usecols=COLS_BASE_COMUNAL, dtype=DTYPES_BASE_COMUNAL)
 
     print(f"Datos cargados: {df.shape}")
 
     # 2. Ingeniería de Atributos a Nivel Comunal
     # Codificamos la dependencia para poder sumar
-    df['es_municipal'] = df['categoria_dependencia'].apply(lambda x: 1 if 'Municipal' in str(x) or 'SLEP' in str(x) else 0)
-    df['es_subvencionado'] = df['categoria_dependencia'].apply(lambda x: 1 if 'Subvencionado' in str(x) else 0)
-    df['es_pagado'] = df['categoria_dependencia'].apply(lambda x: 1 if 'Pagado' in str(x) else 0)
+    dep = df['categoria_dependencia'].astype(str)
+    df['es_municipal'] = dep.str.contains('Municipal|SLEP', regex=True).astype(np.int8)
+    df['es_subvencionado'] = dep.str.contains('Subvencionado', regex=False).astype(np.int8)
+    df['es_pagado'] = dep.str.contains('Pagado', regex=False).astype(np.int8)
     
     # Agregación
     comunal = df.groupby('NOM_COM_RBD').agg({
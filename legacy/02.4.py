@@ -47,7 +47,11 @@ def main():
             df_mat = pd.read_csv('data/raw/Matricula_2024.csv', sep=';', usecols=['RBD', 'CUR_SIM_TOT'])
             df_mat['RBD'] = pd.to_numeric(df_mat['RBD'], errors='coerce')
             df = df.merge(df_mat, on='RBD', how='left')
-            df['ratio_alumno_curso'] = df['MAT_TOTAL'] / df['CUR_SIM_TOT']
+            # División enmascarada como en 01_procesamiento: sin cursos (0 o NaN) el ratio queda NaN, no inf
+            cur = df['CUR_SIM_TOT'].to_numpy(dtype=np.float64)
+            ratio_curso = np.full_like(cur, np.nan)
+            np.divide(df['MAT_TOTAL'].to_numpy(dtype=np.float64), cur, out=ratio_curso, where=cur > 0)
+            df['ratio_alumno_curso'] = ratio_curso
             print("✅ Recuperación exitosa.")
         except Exception as e:
             print(f"❌ No se pudo calcular ratio curso: {e}")
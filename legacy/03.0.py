@@ -2,72 +2,30 @@ import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import unicodedata
 import os
-import requests
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # build_geo_cache vive en la raíz
+from build_geo_cache import cargar_comunas, cargar_agregado_comunal, descargar_shapefile
 import numpy as np
 
 # =============================================================================
-# 1. FUNCIONES DE UTILIDAD (Descarga y Normalización)
-# =============================================================================
-
-def normalizar_texto(texto):
-    """Estandariza nombres: Mayúsculas, sin tildes, sin ñ."""
-    if pd.isna(texto): return ""
-    texto = str(texto).upper()
-    texto = unicodedata.normalize('NFD', texto)
-    texto = u"".join([c for c in texto if unicodedata.category(c) != 'Mn'])
-    return texto.strip()
-
-def descargar_shapefile_hito2():
-    """Descarga el shapefile específico que usaste en el Hito 2 (COMUNA_C17)"""
-    output_dir = 'data/external/comunas_hito2'
-    os.makedirs(output_dir, exist_ok=True)
-    
-    base_url = "https://github.com/PLUMAS-research/visualization-course-materials/raw/master/data/comunas_rm/COMUNA_C17"
-    extensions = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
-    
-    print("⬇️ Descargando mapa del curso...")
-    for ext in extensions:
-        try:
-            r = requests.get(f"{base_url}{ext}", allow_redirects=True)
-            if r.status_code == 200:
-                with open(f"{output_dir}/COMUNA_C17{ext}", 'wb') as f:
-                    f.write(r.content)
-        except Exception as e:
-            print(f"Advertencia descargando {ext}: {e}")
-            
-    return f"{output_dir}/COMUNA_C17.shp"
-
-# =============================================================================
-# 2. PROCESO PRINCIPAL
+# PROCESO PRINCIPAL (descarga y normalización viven en build_geo_cache)
 # =============================================================================
 
 def main():
     print("--- Generando Mapa Hito 3 (Corregido) ---")
     
-    # 1. CARGAR DATOS (Tu base consolidada)
-    df = pd.read_csv('data/processed/base_consolidada_rm_2024.csv')
-    
-    # Agregar por comuna (Calculamos el promedio del ratio)
-    # Asegúrate de usar los nombres de columnas que existen en tu CSV
-    df_agg = df.groupby('NOM_COM_RBD')['ratio_alumno_docente'].mean().reset_index()
-    df_agg.rename(columns={'NOM_COM_RBD': 'Comuna_Norm', 'ratio_alumno_docente': 'valor'}, inplace=True)
+    # 1. CARGAR DATOS (promedio del ratio por comuna, desde la caché geográfica)
+    df_agg = cargar_agregado_comunal('data/processed/base_consolidada_rm_2024.csv')[['Comuna_Norm', 'valor']]
     
     # 2. CARGAR MAPA (Shapefile)
-    shp_path = descargar_shapefile_hito2()
+    # 3. EL FIX: la caché ya trae el mapa con 'nombre_norm' normalizado para que cruce
+    shp_path = descargar_shapefile()
     try:
-        gdf_comunas = gpd.read_file(shp_path)
+        gdf_comunas = cargar_comunas(shp_path)
     except:
         print("❌ No se pudo cargar el shapefile. Verifica la descarga.")
         return
-
-    # 3. EL FIX: NORMALIZAR EL MAPA PARA QUE CRUCE
-    # Buscamos la columna de nombre en el shapefile (suele ser NOM_COMUNA)
-    col_nombre_mapa = 'NOM_COMUNA' if 'NOM_COMUNA' in gdf_comunas.columns else gdf_comunas.columns[0]
-    
-    print(f"Normalizando nombres del mapa (Columna: {col_nombre_mapa})...")
-    gdf_comunas['nombre_norm'] = gdf_comunas[col_nombre_mapa].apply(normalizar_texto)
     
     # Filtramos solo la RM (para evitar pintar todo Chile si el shp es nacional)
     # Usamos un bounding box aproximado de Santiago o filtramos por nombres conocidos
@@ -1,23 +1,18 @@
 import pandas as pd
 import geopandas as gpd
-import unicodedata
 import os
-
-# Función de normalización (la misma que usamos)
-def normalizar(texto):
-    if pd.isna(texto): return ""
-    texto = str(texto).upper()
-    texto = unicodedata.normalize('NFD', texto)
-    texto = u"".join([c for c in texto if unicodedata.category(c) != 'Mn'])
-    return texto.strip()
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # io_utils y build_geo_cache viven en la raíz
+from build_geo_cache import cargar_agregado_comunal
+# Función de normalización: la misma del ETL y del caché geográfico
+from io_utils import normalizar_texto as normalizar
 
 def main():
     print("--- DIAGNÓSTICO DE NOMBRES DE COMUNA ---")
     
     # 1. Cargar tus datos (CSV)
     try:
-        df = pd.read_csv('data/processed/base_consolidada_rm_2024.csv')
-        comunas_csv = set(df['NOM_COM_RBD'].unique())
+        comunas_csv = pd.Index(cargar_agregado_comunal('data/processed/base_consolidada_rm_2024.csv')['Comuna_Norm'].unique())
         print(f"✅ CSV cargado: {len(comunas_csv)} comunas encontradas.")
     except:
         print("❌ Error cargando CSV. Verifica la ruta.")
@@ -44,8 +39,8 @@ def main():
         print(f"   Columna de nombre detectada: '{col_nombre}'")
         
         # Normalizar nombres del mapa
-        gdf['nombre_norm'] = gdf[col_nombre].apply(normalizar)
-        comunas_mapa = set(gdf['nombre_norm'].unique())
+        gdf['nombre_norm'] = normalizar(gdf[col_nombre])
+        comunas_mapa = pd.Index(gdf['nombre_norm'].unique())
         
     except Exception as e:
         print(f"❌ Error cargando Mapa: {e}")
@@ -56,12 +51,12 @@ def main():
     print("🔍 RESULTADOS DEL CRUCE:")
     
     en_ambos = comunas_csv.intersection(comunas_mapa)
-    solo_csv = comunas_csv - comunas_mapa
-    solo_mapa = comunas_mapa - comunas_csv
+    solo_csv = comunas_csv.difference(comunas_mapa)
+    solo_mapa = comunas_mapa.difference(comunas_csv)
 
-    print(solo_mapa)
+    print(list(solo_mapa))
     print("")
-    print(solo_csv)
+    print(list(solo_csv))
     
     print(f"Coincidencias perfectas: {len(en_ambos)}")
     print(f"Comunas en CSV sin mapa: {len(solo_csv)}")
@@ -1,49 +1,21 @@
 import pandas as pd
+import numpy as np
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import matplotlib.patheffects as pe
 import seaborn as sns
-import unicodedata
 import os
-import requests
-from shapely.geometry import box
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # build_geo_cache y map_utils viven en la raíz
+from build_geo_cache import cargar_comunas_urbano, descargar_shapefile
+from map_utils import (parche_poligono, aspecto_geografico, dibujar_coropletas,
+                       abreviar_comunas, etiquetas_comunas, anotar_comunas)
 
 # =============================================================================
 # CONFIGURACIÓN
 # =============================================================================
 sns.set_theme(style="whitegrid")
 
-def normalizar_texto(texto):
-    """Normaliza nombres para cruzar datos (ej: Ñuñoa -> NUNOA)"""
-    if pd.isna(texto): return ""
-    texto = str(texto).upper()
-    texto = unicodedata.normalize('NFD', texto)
-    texto = u"".join([c for c in texto if unicodedata.category(c) != 'Mn'])
-    return texto.strip()
-
-def descargar_shapefile_hito2():
-    """Descarga el shapefile específico del curso"""
-    output_dir = 'data/external/comunas_hito2'
-    os.makedirs(output_dir, exist_ok=True)
-    
-    base_url = "https://github.com/PLUMAS-research/visualization-course-materials/raw/master/data/comunas_rm/COMUNA_C17"
-    extensions = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
-    
-    print("⬇️ Verificando mapa base...")
-    for ext in extensions:
-        filepath = f"{output_dir}/COMUNA_C17{ext}"
-        if not os.path.exists(filepath):
-            try:
-                print(f"   - Descargando {ext}...")
-                r = requests.get(f"{base_url}{ext}", allow_redirects=True)
-                if r.status_code == 200:
-                    with open(filepath, 'wb') as f:
-                        f.write(r.content)
-            except Exception as e:
-                print(f"   ⚠️ Error: {e}")
-            
-    return f"{output_dir}/COMUNA_C17.shp"
-
 def main():
     print("--- Generando Mapa Ponderado (Ratio Real) ---")
     
@@ -53,58 +25,57 @@ def main():
         print("⚠️ No encuentro 'base_consolidada_rm_2024.csv'.")
         return
     df = pd.read_csv(archivo_datos)
+    # Llaves de agrupación como categóricas: el groupby trabaja sobre códigos enteros
+    df['PAGO_MENSUAL'] = df['PAGO_MENSUAL'].astype('string').str.strip().str.upper().astype('category')
+    df['NOM_COM_RBD'] = df['NOM_COM_RBD'].astype('category')
     
     # 2. CÁLCULO PONDERADO (EL FIX)
     print("Calculando ratios ponderados por matrícula...")
     
-    # Filtramos 'SIN INFORMACION'
-    df = df[df['PAGO_MENSUAL'] != 'SIN INFORMACION'].copy()
+    # Clasificación Binaria (antes del filtro, para no tener que copiar el subconjunto filtrado)
+    df['tipo_pago_binario'] = pd.Categorical(np.where(df['PAGO_MENSUAL'] == 'GRATUITO', 'GRATUITO', 'PAGADO'))
     
-    # Clasificación Binaria
-    df['tipo_pago_binario'] = df['PAGO_MENSUAL'].apply(
-        lambda x: 'GRATUITO' if str(x).strip().upper() == 'GRATUITO' else 'PAGADO'
-    )
+    # Filtramos 'SIN INFORMACION' (después solo se lee: no hace falta .copy())
+    df = df[df['PAGO_MENSUAL'] != 'SIN INFORMACION']
     
     # --- AQUÍ ESTÁ EL CAMBIO CLAVE ---
     # En lugar de promediar los ratios, sumamos alumnos y docentes por grupo
     # y LUEGO dividimos. Esto es matemáticamente un promedio ponderado.
-    agrupado = df.groupby(['NOM_COM_RBD', 'tipo_pago_binario'])[['MAT_TOTAL', 'DC_TOT']].sum().reset_index()
+    # La comuna se agrupa, pivotea y cruza con el mapa como código entero (el de la categórica)
+    comunas = df['NOM_COM_RBD'].cat.categories
+    com_code = df['NOM_COM_RBD'].cat.codes.astype(np.int32).rename('COM_CODE')
+    agrupado = df.groupby([com_code, 'tipo_pago_binario'], observed=True)[['MAT_TOTAL', 'DC_TOT']].sum().reset_index()
+    agrupado = agrupado[agrupado['COM_CODE'] >= 0] # -1 = comuna vacía
     
     # Calculamos el ratio "real" del sector
     agrupado['ratio_ponderado'] = agrupado['MAT_TOTAL'] / agrupado['DC_TOT']
     
     # Pivoteamos
-    map_pivot = agrupado.pivot(index='NOM_COM_RBD', columns='tipo_pago_binario', values='ratio_ponderado')
+    map_pivot = agrupado.pivot(index='COM_CODE', columns='tipo_pago_binario', values='ratio_ponderado')
     map_pivot.reset_index(inplace=True)
+    map_pivot['NOM_COM_RBD'] = comunas[map_pivot['COM_CODE']]
     
     # Mostramos los extremos para verificar la lógica
     print("\nTop 5 Comunas con mejor ratio (PAGADO):")
     print(map_pivot.sort_values('PAGADO').head(5)[['NOM_COM_RBD', 'PAGADO']])
 
     # 3. CARGAR Y PREPARAR MAPA
-    shp_path = descargar_shapefile_hito2()
-    try:
-        gdf_comunas = gpd.read_file(shp_path)
-    except:
-        print("❌ Error cargando shapefile.")
-        return
-
-    # Normalizar mapa
-    col_nombre_mapa = 'NOM_COMUNA' if 'NOM_COMUNA' in gdf_comunas.columns else gdf_comunas.columns[0]
-    gdf_comunas['nombre_norm'] = gdf_comunas[col_nombre_mapa].apply(normalizar_texto)
+    shp_path = descargar_shapefile()
     
     # 4. APLICAR ZOOM URBANO
     # Southwest: -33.642527, -70.872116 | Northeast: -33.327552, -70.469742
     bbox_coords = [-70.872116, -33.642527, -70.469742, -33.327552]
     
-    if gdf_comunas.crs.to_string() != "EPSG:4326":
-        gdf_comunas = gdf_comunas.to_crs(epsg=4326)
-    
-    zona_urbana = box(bbox_coords[0], bbox_coords[1], bbox_coords[2], bbox_coords[3])
-    gdf_santiago_urbano = gpd.clip(gdf_comunas, zona_urbana)
+    # Mapa normalizado, en EPSG:4326 y ya recortado, desde la caché Feather
+    try:
+        gdf_santiago_urbano = cargar_comunas_urbano(bbox_coords, shp_path)
+    except:
+        print("❌ Error cargando shapefile.")
+        return
     
     # 5. MERGE FINAL
-    gdf_final = gdf_santiago_urbano.merge(map_pivot, left_on='nombre_norm', right_on='NOM_COM_RBD', how='left')
+    gdf_santiago_urbano['COM_CODE'] = pd.Index(comunas).get_indexer(gdf_santiago_urbano['nombre_norm']).astype(np.int32) # -1 = sin datos
+    gdf_final = gdf_santiago_urbano.merge(map_pivot, on='COM_CODE', how='left')
     
     # 6. VISUALIZACIÓN COMPARATIVA
     print("Dibujando mapas...")
@@ -117,56 +88,30 @@ def main():
     # Esto es importante: los ratios ponderados suelen ser más altos que los promedios simples
     vmin, vmax = 12, 32 
     
-    # Mapa 1: Colegios Gratuitos
-    gdf_final.plot(
-        column='GRATUITO', 
-        ax=ax1, 
-        cmap=cmap, 
-        legend=True, 
-        vmin=vmin, vmax=vmax,
-        legend_kwds={'label': "Alumnos por Docente (Ponderado)", 'shrink': 0.5},
-        missing_kwds={'color': 'lightgrey', 'hatch': '///', 'label': 'Sin datos'}
-    )
+    # Los polígonos son los mismos en ambos mapas: se construyen una sola vez y solo cambia el color
+    parches = [parche_poligono(g) for g in gdf_final.geometry]
+    for ax in [ax1, ax2]:
+        ax.set_aspect(aspecto_geografico(gdf_final))
+    
+    # Mapa 1: Colegios Gratuitos | Mapa 2: Colegios Pagados
+    # Una sola escala de color compartida por ambos mapas y sus barras
+    dibujar_coropletas([ax1, ax2], parches, [gdf_final['GRATUITO'], gdf_final['PAGADO']],
+                       cmap, vmin, vmax, "Alumnos por Docente (Ponderado)")
     ax1.set_title('Colegios GRATUITOS', fontsize=16, fontweight='bold')
-    ax1.axis('off')
-    
-    # Mapa 2: Colegios Pagados
-    gdf_final.plot(
-        column='PAGADO', 
-        ax=ax2, 
-        cmap=cmap, 
-        legend=True,
-        vmin=vmin, vmax=vmax,
-        legend_kwds={'label': "Alumnos por Docente (Ponderado)", 'shrink': 0.5},
-        missing_kwds={'color': 'lightgrey', 'hatch': '///', 'label': 'Sin datos'}
-    )
     ax2.set_title('Colegios PAGADOS (Copago/Particular)', fontsize=16, fontweight='bold')
-    ax2.axis('off')
     
-    # Etiquetas
+    # Etiquetas: centroides, áreas y textos en una pasada vectorizada, compartidos por ambos mapas
+    etiquetas = etiquetas_comunas(gdf_final, abreviar_comunas(gdf_final['nombre_norm']), area_min=0.001)
+    anotar_comunas([ax1, ax2], etiquetas, horizontalalignment='center', fontsize=8, color='black', weight='bold',
+                   path_effects=[pe.withStroke(linewidth=2, foreground="white")])
     for ax in [ax1, ax2]:
-        for idx, row in gdf_final.iterrows():
-            if row.geometry.area > 0.001: 
-                txt = row['nombre_norm'].title()
-                if "PEDRO AGUIRRE" in txt.upper(): txt = "PAC"
-                if "ESTACION CENTRAL" in txt.upper(): txt = "Est. Central"
-                if "SANTIAGO" == txt.upper(): txt = "Stgo"
-                
-                ax.annotate(
-                    text=txt, 
-                    xy=(row.geometry.centroid.x, row.geometry.centroid.y),
-                    horizontalalignment='center',
-                    fontsize=8,
-                    color='black',
-                    weight='bold',
-                    path_effects=[pe.withStroke(linewidth=2, foreground="white")]
-                )
+        ax.axis('off')
 
     plt.suptitle('La Brecha Real: Carga Docente Ponderada por Matrícula', fontsize=20, y=0.92)
     plt.tight_layout()
     
     os.makedirs('figures/finales', exist_ok=True)
-    output_path = 'figures/finales/05_mapa_ponderado_gratuidad.png'
+    output_path = 'figures/finales/05_mapa_ponderado_gratuidad.pdf'
     plt.savefig(output_path, dpi=300, bbox_inches='tight')
     print(f"✅ ¡Mapa Ponderado guardado en: {output_path}!")
 
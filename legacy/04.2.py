@@ -17,15 +17,16 @@ def main():
         df = pd.read_csv('data/processed/base_consolidada_rm_2024.csv')
 
     # 2. Clasificación Binaria (Gratuito vs Pagado)
-    # Filtramos 'SIN INFORMACION' para ser más precisos
-    df = df[df['PAGO_MENSUAL'] != 'SIN INFORMACION'].copy()
+    # Llaves de agrupación como categóricas: el groupby trabaja sobre códigos enteros
+    df['PAGO_MENSUAL'] = df['PAGO_MENSUAL'].astype('string').str.strip().str.upper().astype('category')
+    df['NOM_COM_RBD'] = df['NOM_COM_RBD'].astype('category')
+    df['tipo_pago'] = pd.Categorical(np.where(df['PAGO_MENSUAL'] == 'GRATUITO', 'GRATUITO', 'PAGADO'))
     
-    df['tipo_pago'] = df['PAGO_MENSUAL'].apply(
-        lambda x: 'GRATUITO' if str(x).strip().upper() == 'GRATUITO' else 'PAGADO'
-    )
+    # Filtramos 'SIN INFORMACION' para ser más precisos (al final: el subconjunto solo se lee, sin .copy())
+    df = df[df['PAGO_MENSUAL'] != 'SIN INFORMACION']
 
     # 3. Agrupación por Comuna
-    comunal = df.groupby(['NOM_COM_RBD', 'tipo_pago']).agg({
+    comunal = df.groupby(['NOM_COM_RBD', 'tipo_pago'], observed=True).agg({
         'RBD': 'count',          # Número de colegios
         'MAT_TOTAL': 'mean'      # Tamaño promedio (Matrícula)
     }).reset_index()
@@ -34,7 +35,7 @@ def main():
     comunal.rename(columns={'RBD': 'num_colegios', 'MAT_TOTAL': 'tamano_promedio'}, inplace=True)
 
     # 4. Ordenar para el gráfico (por cantidad total de colegios en la comuna)
-    orden_comunas = df.groupby('NOM_COM_RBD')['RBD'].count().sort_values(ascending=False).index
+    orden_comunas = df.groupby('NOM_COM_RBD', observed=True)['RBD'].count().sort_values(ascending=False).index
     
     # GRÁFICO 1: Número de Colegios (Oferta)
     plt.figure(figsize=(14, 8))
@@ -29,9 +29,8 @@ def main():
     
     # Crear etiqueta legible para el gráfico
     # Si dice "GRATUITO" es "Gratuito", si no es "Pagado" (Copago o Particular)
-    df['Tipo de Financiamiento'] = df['PAGO_MENSUAL_NORM'].apply(
-        lambda x: 'Gratuito (Público/Subv)' if str(x).strip().upper() == 'GRATUITO' else 'Pagado (Copago/Privado)'
-    )
+    pago = df['PAGO_MENSUAL_NORM'].astype(str).str.strip().str.upper()
+    df['Tipo de Financiamiento'] = np.where(pago == 'GRATUITO', 'Gratuito (Público/Subv)', 'Pagado (Copago/Privado)')
     
     # Agrupar por Comuna y Tipo
     # Calculamos: Cuántos colegios hay (count) y Cuántos alumnos tienen en promedio (mean de MAT_TOTAL)
@@ -12,15 +12,17 @@ Este script realiza:
 
 import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib import cbook
 import seaborn as sns
 import os
+import sys
 import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # io_utils vive en la raíz
+from io_utils import load_base_simce
 
 # --- CONFIGURACIÓN ---
 # Ajusta estas rutas según tu estructura de carpetas
-PATH_BASE = 'data/processed/base_consolidada_rm_2024.csv'
-PATH_SIMCE_4B = 'data/raw/simce4b2024_rbd_preliminar.csv'
-PATH_SIMCE_2M = 'data/raw/simce2m2024_rbd_preliminar.csv'
+# (base + SIMCE: rutas, merge y clasificación viven en io_utils.load_base_simce, compartido con 063)
 OUTPUT_DIR = 'figures/analisis_pago_simce'
 
 # Crear carpeta de salida si no existe
@@ -31,90 +33,31 @@ sns.set_style("whitegrid")
 COLOR_GRATUITO = '#4daf4a'  # Verde
 COLOR_PAGADO = '#e41a1c'    # Rojo
 
-def cargar_y_unir_datos():
-    """Carga los datasets y realiza el merge por RBD."""
-    print(">>> Cargando datos...")
-    
-    # 1. Cargar Base Maestra
-    df_base = pd.read_csv(PATH_BASE, sep=',')
-    
-    # 2. Cargar SIMCE (con encoding latin-1 para evitar errores)
-    df_simce_4b = pd.read_csv(PATH_SIMCE_4B, sep=';', encoding='latin-1')
-    df_simce_2m = pd.read_csv(PATH_SIMCE_2M, sep=';', encoding='latin-1')
-    
-    # 3. Seleccionar columnas relevantes SIMCE
-    cols_4b = ['rbd', 'prom_lect4b_rbd', 'prom_mate4b_rbd']
-    cols_2m = ['rbd', 'prom_lect2m_rbd', 'prom_mate2m_rbd']
-    
-    df_4b_sel = df_simce_4b[cols_4b].rename(columns={
-        'rbd': 'RBD', 'prom_lect4b_rbd': 'SIMCE_4B_LECT', 'prom_mate4b_rbd': 'SIMCE_4B_MATE'
-    })
-    
-    df_2m_sel = df_simce_2m[cols_2m].rename(columns={
-        'rbd': 'RBD', 'prom_lect2m_rbd': 'SIMCE_2M_LECT', 'prom_mate2m_rbd': 'SIMCE_2M_MATE'
-    })
-    
-    # Asegurar tipos numéricos para el merge
-    for df in [df_base, df_4b_sel, df_2m_sel]:
-        df['RBD'] = pd.to_numeric(df['RBD'], errors='coerce')
-
-    # 4. Merge (Left Join)
-    print(">>> Uniendo bases de datos...")
-    df_merged = df_base.merge(df_4b_sel, on='RBD', how='left')\
-                       .merge(df_2m_sel, on='RBD', how='left')
-    
-    return df_merged
-
-def clasificar_pago(row):
-    """Clasifica en 'Gratuito' o 'Pagado' basado en mensualidad y dependencia."""
-    pago = str(row['PAGO_MENSUAL']).upper()
-    dep = str(row['categoria_dependencia']).upper()
-    
-    if pago == 'GRATUITO':
-        return 'Gratuito'
-    elif pago == 'SIN INFORMACION':
-        # Asumimos gratuito si es público, pagado si es privado sin info
-        if any(x in dep for x in ['MUNICIPAL', 'SLEP', 'ADMIN_DELEGADA']):
-            return 'Gratuito'
-        else:
-            return 'Pagado'
-    else:
-        return 'Pagado'
-
-def procesar_datos(df):
-    """Aplica lógica de negocio y cálculos agregados."""
-    print(">>> Procesando métricas...")
-    
-    # Clasificar Tipo de Pago
-    df['TIPO_PAGO'] = df.apply(clasificar_pago, axis=1)
-    
-    # Calcular Promedio General SIMCE (4B y 2M)
-    simce_cols = ['SIMCE_4B_LECT', 'SIMCE_4B_MATE', 'SIMCE_2M_LECT', 'SIMCE_2M_MATE']
-    for col in simce_cols:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-    df['SIMCE_PROM_RBD'] = df[simce_cols].mean(axis=1)
-    
-    return df
-
 def generar_estadisticas_comunales(df):
     """Agrupa los datos por comuna."""
-    stats = df.groupby('NOM_COM_RBD').apply(lambda x: pd.Series({
-        'Total_Est': len(x),
-        'Est_Gratuito': (x['TIPO_PAGO'] == 'Gratuito').sum(),
-        'Est_Pagado': (x['TIPO_PAGO'] == 'Pagado').sum(),
-        'Total_Mat': x['MAT_TOTAL'].sum(),
-        'Mat_Gratuito': x.loc[x['TIPO_PAGO'] == 'Gratuito', 'MAT_TOTAL'].sum(),
-        'Mat_Pagado': x.loc[x['TIPO_PAGO'] == 'Pagado', 'MAT_TOTAL'].sum(),
-        'SIMCE_Prom_Comuna': x['SIMCE_PROM_RBD'].mean()
-    }))
+    # Agregación nativa (sin lambda por grupo): indicadores y matrícula por tipo precalculados
+    es_pagado = df['TIPO_PAGO'] == 'Pagado'
+    df['IS_PAID_INT'] = es_pagado.astype(np.int8)
+    df['IS_FREE_INT'] = (df['TIPO_PAGO'] == 'Gratuito').astype(np.int8)
+    df['MAT_PAID'] = df['MAT_TOTAL'].where(es_pagado, 0)
+    df['MAT_FREE'] = df['MAT_TOTAL'].where(~es_pagado, 0)
+    stats = df.groupby('NOM_COM_RBD', observed=True).agg(
+        Total_Est=('IS_PAID_INT', 'size'),
+        Est_Gratuito=('IS_FREE_INT', 'sum'),
+        Est_Pagado=('IS_PAID_INT', 'sum'),
+        Total_Mat=('MAT_TOTAL', 'sum'),
+        Mat_Gratuito=('MAT_FREE', 'sum'),
+        Mat_Pagado=('MAT_PAID', 'sum'),
+        SIMCE_Prom_Comuna=('SIMCE_PROM_RBD', 'mean')
+    )
     
     # Calcular porcentajes
     stats['Pct_Est_Pagado'] = stats['Est_Pagado'] / stats['Total_Est']
     stats['Pct_Mat_Pagado'] = stats['Mat_Pagado'] / stats['Total_Mat']
     
-    # Rellenar NaNs con 0 para cálculos
-    stats = stats.fillna(0)
+    # Rellenar NaNs con 0 para cálculos. Todo en float64, como salía con las lambdas: el resumen versionado
+    # escribe los conteos como '48.0'
+    stats = stats.fillna(0).astype(np.float64)
     
     return stats.sort_values('Pct_Est_Pagado', ascending=True)
 
@@ -122,30 +65,28 @@ def graficar_oferta_demanda(stats):
     """Genera gráfico comparativo de Establecimientos vs Matrícula."""
     print(">>> Generando gráfico de Oferta vs Demanda...")
     
-    # Preparar datos para plot
-    plot_data = stats[['Pct_Est_Pagado', 'Pct_Mat_Pagado']].copy()
-    plot_data['Pct_Est_Gratuito'] = 1 - plot_data['Pct_Est_Pagado']
-    plot_data['Pct_Mat_Gratuito'] = 1 - plot_data['Pct_Mat_Pagado']
+    # Preparar datos para plot: proporciones pagadas como arrays float32 (la parte gratuita es el complemento)
+    pos = np.arange(len(stats))
+    pct_est = stats['Pct_Est_Pagado'].to_numpy(dtype=np.float32)
+    pct_mat = stats['Pct_Mat_Pagado'].to_numpy(dtype=np.float32)
     
     fig, axes = plt.subplots(1, 2, figsize=(20, 12), sharey=True)
     
+    # Barras apiladas directo con matplotlib: Gratuito desde 0, Pagado a continuación
+    for ax, pct_pagado in [(axes[0], pct_est), (axes[1], pct_mat)]:
+        ax.barh(pos, 1 - pct_pagado, height=0.8, color=COLOR_GRATUITO, label='Gratuito')
+        ax.barh(pos, pct_pagado, left=1 - pct_pagado, height=0.8, color=COLOR_PAGADO, label='Pagado')
+        ax.legend(loc='lower left')
+    axes[0].set_yticks(pos, stats.index.astype(str))
+    axes[0].set_ylabel(stats.index.name)
+    
     # Gráfico 1: Establecimientos (Oferta)
-    plot_data[['Pct_Est_Gratuito', 'Pct_Est_Pagado']].plot(
-        kind='barh', stacked=True, ax=axes[0], 
-        color=[COLOR_GRATUITO, COLOR_PAGADO], width=0.8
-    )
     axes[0].set_title('Oferta: % de Establecimientos (Gratuito vs Pagado)', fontsize=14)
     axes[0].set_xlabel('Proporción', fontsize=12)
-    axes[0].legend(['Gratuito', 'Pagado'], loc='lower left')
     
     # Gráfico 2: Matrícula (Demanda)
-    plot_data[['Pct_Mat_Gratuito', 'Pct_Mat_Pagado']].plot(
-        kind='barh', stacked=True, ax=axes[1], 
-        color=[COLOR_GRATUITO, COLOR_PAGADO], width=0.8
-    )
     axes[1].set_title('Demanda: % de Matrícula (Gratuito vs Pagado)', fontsize=14)
     axes[1].set_xlabel('Proporción', fontsize=12)
-    axes[1].legend(['Gratuito', 'Pagado'], loc='lower left')
     
     plt.tight_layout()
     plt.savefig(os.path.join(OUTPUT_DIR, '01_oferta_vs_demanda_pago.png'), dpi=150)
@@ -155,23 +96,31 @@ def graficar_brecha_simce(df):
     """Genera boxplot de resultados SIMCE por tipo de pago."""
     print(">>> Generando gráfico de Brecha SIMCE...")
     
-    plt.figure(figsize=(10, 8))
+    fig, ax = plt.subplots(figsize=(10, 8))
+    
+    # Estadísticas de cada caja (cuartiles, bigotes 1.5·IQR, atípicos, media) en una sola pasada por grupo;
+    # las mismas sirven para el boxplot y para el texto de las medianas
+    grupos = ['Gratuito', 'Pagado']
+    valores = df['SIMCE_PROM_RBD'].to_numpy(dtype=np.float64)
+    tipo = df['TIPO_PAGO'].to_numpy()
+    con_dato = ~np.isnan(valores)
+    cajas = cbook.boxplot_stats([valores[con_dato & (tipo == g)] for g in grupos], labels=grupos)
     
     # Boxplot
-    sns.boxplot(
-        x='TIPO_PAGO', y='SIMCE_PROM_RBD', data=df, 
-        palette={'Gratuito': COLOR_GRATUITO, 'Pagado': COLOR_PAGADO},
+    artistas = ax.bxp(
+        cajas, positions=[0, 1], widths=0.8, patch_artist=True,
         showmeans=True, meanprops={"marker":"o","markerfacecolor":"white", "markeredgecolor":"black"}
     )
+    for caja, color in zip(artistas['boxes'], [COLOR_GRATUITO, COLOR_PAGADO]):
+        caja.set_facecolor(color)
     
     plt.title('Distribución de Puntajes SIMCE Promedio 2024 (4°B y IIM)\npor Tipo de Financiamiento', fontsize=14)
     plt.ylabel('Puntaje Promedio', fontsize=12)
     plt.xlabel('Tipo de Establecimiento', fontsize=12)
     
-    # Calcular y mostrar medianas en texto
-    medianas = df.groupby('TIPO_PAGO')['SIMCE_PROM_RBD'].median()
-    plt.text(0, medianas['Gratuito'] + 2, f"Mediana: {medianas['Gratuito']:.0f}", ha='center', fontweight='bold')
-    plt.text(1, medianas['Pagado'] + 2, f"Mediana: {medianas['Pagado']:.0f}", ha='center', fontweight='bold')
+    # Mostrar medianas en texto (ya calculadas para las cajas)
+    for pos, caja in enumerate(cajas):
+        plt.text(pos, caja['med'] + 2, f"Mediana: {caja['med']:.0f}", ha='center', fontweight='bold')
 
     plt.tight_layout()
     plt.savefig(os.path.join(OUTPUT_DIR, '02_brecha_simce_pago.png'), dpi=150)
@@ -188,14 +137,19 @@ def graficar_correlacion(stats):
         s=150, alpha=0.7, color='#2b8cbe', edgecolor='black'
     )
     
-    # Etiquetas para comunas extremas o relevantes
-    for idx, row in stats.iterrows():
-        # Etiquetar extremos (muy pagado, muy alto simce o muy bajo simce)
-        if row['Pct_Mat_Pagado'] > 0.60 or row['SIMCE_Prom_Comuna'] > 280 or row['SIMCE_Prom_Comuna'] < 240:
-            plt.text(row['Pct_Mat_Pagado']+0.01, row['SIMCE_Prom_Comuna'], idx, fontsize=9, alpha=0.8)
+    # Etiquetas para comunas extremas o relevantes (muy pagado, muy alto simce o muy bajo simce):
+    # el filtro es vectorizado y solo se recorren las comunas que llevan texto
+    px = stats['Pct_Mat_Pagado'].to_numpy()
+    py = stats['SIMCE_Prom_Comuna'].to_numpy()
+    extremo = (px > 0.60) | (py > 280) | (py < 240)
+    for nombre, x, y in zip(stats.index[extremo], px[extremo], py[extremo]):
+        plt.text(x + 0.01, y, nombre, fontsize=9, alpha=0.8)
     
-    # Línea de tendencia
-    sns.regplot(x='Pct_Mat_Pagado', y='SIMCE_Prom_Comuna', data=stats, scatter=False, color='gray', line_kws={'linestyle':'--'})
+    # Línea de tendencia: ajuste lineal directo (sin el bootstrap del intervalo de regplot)
+    x = stats['Pct_Mat_Pagado'].to_numpy(dtype=np.float64)
+    pendiente, intercepto = np.polyfit(x, stats['SIMCE_Prom_Comuna'].to_numpy(dtype=np.float64), 1)
+    x_linea = np.array([x.min(), x.max()])
+    plt.plot(x_linea, pendiente * x_linea + intercepto, color='gray', linestyle='--')
     
     plt.title('Correlación: Segregación (% Matrícula Pagada) vs Desempeño SIMCE Comunal', fontsize=14)
     plt.xlabel('Proporción de Estudiantes en Colegios Pagados (0.0 a 1.0)', fontsize=12)
@@ -209,11 +163,9 @@ def graficar_correlacion(stats):
 # --- EJECUCIÓN PRINCIPAL ---
 if __name__ == "__main__":
     try:
-        # 1. Cargar
-        df_raw = cargar_y_unir_datos()
-        
-        # 2. Procesar
-        df_processed = procesar_datos(df_raw)
+        # 1-2. Cargar y procesar (merge, clasificación Gratuito/Pagado y promedio SIMCE por colegio)
+        print(">>> Cargando datos...")
+        df_processed = load_base_simce()
         stats_comunal = generar_estadisticas_comunales(df_processed)
         
         # Guardar CSV de estadísticas comunales para revisión
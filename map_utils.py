@@ -0,0 +1,69 @@
+import numpy as np
+import shapely
+from matplotlib.cm import ScalarMappable
+from matplotlib.collections import PatchCollection
+from matplotlib.colors import Normalize
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
+
+# Helpers de dibujo para los coropléticos de comunas: los polígonos se convierten a parches una sola vez
+# y cada mapa solo cambia el color, en vez de que geopandas reconstruya todo en cada .plot(column=...)
+
+def parche_poligono(geom):
+    """(Multi)Polygon de shapely -> PathPatch de matplotlib (anillos exteriores + hoyos)."""
+    partes = [geom] if geom.geom_type == 'Polygon' else geom.geoms
+    anillos = []
+    for parte in partes:
+        anillos.append(Path(np.asarray(parte.exterior.coords)[:, :2], closed=True))
+        anillos.extend(Path(np.asarray(r.coords)[:, :2], closed=True) for r in parte.interiors)
+    return PathPatch(Path.make_compound_path(*anillos))
+
+def aspecto_geografico(gdf):
+    """Misma proporción que usa geopandas para coordenadas geográficas (EPSG:4326)."""
+    lat_media = np.mean(gdf.total_bounds[[1, 3]])
+    return 1 / np.cos(np.deg2rad(lat_media))
+
+def dibujar_coropletas(axes, parches, columnas, cmap, vmin, vmax, etiqueta='', shrink=0.5, hatch='///', **estilo):
+    """
+    Un coroplético por eje sobre los mismos parches ('columnas' = valores de cada mapa, en el orden de 'axes').
+    Todos comparten una Normalize y un ScalarMappable, que también alimenta las barras de color.
+    Las comunas sin dato van en gris (achurado por defecto); 'estilo' se pasa a las colecciones (ej: edgecolor).
+    """
+    sm = ScalarMappable(norm=Normalize(vmin, vmax), cmap=cmap)
+    for ax, valores in zip(axes, columnas):
+        valores = np.asarray(valores, dtype=float)
+        con_dato = ~np.isnan(valores)
+        # Relleno rasterizado: en PDF queda como una sola imagen embebida y el texto sigue vectorial
+        pc = PatchCollection([p for p, ok in zip(parches, con_dato) if ok],
+                             cmap=sm.cmap, norm=sm.norm, rasterized=True, **estilo)
+        pc.set_array(valores[con_dato])
+        ax.add_collection(pc)
+        ax.add_collection(PatchCollection([p for p, ok in zip(parches, con_dato) if not ok],
+                                          facecolor='lightgrey', hatch=hatch, rasterized=True, **estilo))
+        ax.autoscale_view()
+        ax.figure.colorbar(sm, ax=ax, label=etiqueta, shrink=shrink)
+    return sm
+
+def abreviar_comunas(nombres):
+    """Nombres normalizados -> etiqueta corta para el mapa (Title Case; PAC, Est. Central, Stgo)."""
+    return np.select([nombres.str.contains('PEDRO AGUIRRE'), nombres.str.contains('ESTACION CENTRAL'),
+                      nombres == 'SANTIAGO'],
+                     ['PAC', 'Est. Central', 'Stgo'], default=nombres.str.title())
+
+def etiquetas_comunas(gdf, textos, area_min, visibles=None):
+    """
+    (textos, x, y) de las comunas con área > area_min (y 'visibles', si se pasa):
+    centroides y áreas en una sola llamada vectorizada de shapely.
+    """
+    geoms = gdf.geometry.to_numpy()
+    centros = shapely.centroid(geoms)
+    mask = shapely.area(geoms) > area_min
+    if visibles is not None:
+        mask &= np.asarray(visibles, dtype=bool)
+    return np.asarray(textos)[mask], shapely.get_x(centros)[mask], shapely.get_y(centros)[mask]
+
+def anotar_comunas(axes, etiquetas, **kwargs):
+    """Dibuja las mismas etiquetas (calculadas una vez con etiquetas_comunas) en cada eje."""
+    for ax in axes:
+        for txt, x, y in zip(*etiquetas):
+            ax.annotate(txt, xy=(x, y), **kwargs)